@@ -0,0 +1,1076 @@
+"""
+任务数据文件工具
+不依赖 Streamlit，可在应用、维护脚本和后台线程中共用
+"""
+
+import os
+import re
+import json
+import gzip
+import zlib
+import bisect
+import hashlib
+import mmap
+import time
+import shutil
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from array import array
+from collections import OrderedDict
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+# 可选的高性能 JSON 解析库，未安装时使用标准库 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 可选的分词库，用于按词元数均衡拆分任务；未安装时使用近似切分
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# 可选的 zstd 压缩库，未安装时只能使用 gzip 压缩存储
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 行偏移索引文件（与数据文件同目录，后缀 .idx）
+LINE_INDEX_SUFFIX = '.idx'
+LINE_INDEX_MAGIC = b'JSONLIDX'
+
+# 压缩存储：文件由独立压缩的帧组成，每帧包含固定条数的数据行，
+# 帧索引文件（后缀 .fidx）记录每帧的字节偏移和起始条目序号，可直接定位到单帧解压
+FRAME_INDEX_SUFFIX = '.fidx'
+FRAME_INDEX_MAGIC = b'JSONLFIX'
+COMPRESSED_FRAME_LINES = 256
+# 压缩格式 -> 文件后缀
+COMPRESSION_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+# 新建任务默认使用的压缩格式（'gzip' / 'zstd'，为空表示不压缩）
+DEFAULT_COMPRESSION = os.environ.get('DATA_COMPRESSION', '')
+
+# 按内容哈希命名的任务数据文件目录（与 data/math 下按 sha256 命名的 PDF 相同的方式）
+BLOB_DIR = os.path.join('data', 'blobs')
+SHA256_HEX_LENGTH = 64
+
+# 上传文件暂存目录，以及流式读取上传文件的块大小
+STAGING_DIR = os.path.join('data', 'staging')
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+# 暂存文件超过该时间未被使用则视为废弃
+STAGING_MAX_AGE_SECONDS = 24 * 3600
+# 超过该大小的上传文件改为多进程并行解析校验
+PARALLEL_PARSE_MIN_BYTES = 32 * 1024 * 1024
+# 并行解析时每个分块的大致字节数（按行边界对齐）
+PARALLEL_PARSE_CHUNK_BYTES = 8 * 1024 * 1024
+
+# 数据缓存按页加载，每页的条目数
+DATASET_PAGE_SIZE = 256
+
+# 进程级数据缓存的内存预算（按原始字节计，可用环境变量 DATASET_CACHE_MB 调整）
+DATASET_CACHE_MAX_BYTES = int(os.environ.get('DATASET_CACHE_MB', '256')) * 1024 * 1024
+
+# 标注页面向后预取的条目数，以及每个会话预取缓存的内存预算
+PREFETCH_AHEAD = int(os.environ.get('PREFETCH_AHEAD', '5'))
+PREFETCH_MAX_BYTES = int(os.environ.get('PREFETCH_CACHE_MB', '64')) * 1024 * 1024
+# 预取器空闲超过该时间后后台线程退出，下次调度时重新启动
+PREFETCH_IDLE_SECONDS = 30
+
+
+def count_jsonl_items(file_path: str) -> int:
+    """流式统计JSONL文件中的非空行数，不把整个文件读入内存"""
+    if not file_path:
+        return 0
+    if compression_of(file_path):
+        try:
+            return get_item_count(file_path)
+        except (OSError, ValueError, zlib.error):
+            return 0
+    count = 0
+    try:
+        with open(file_path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    count += 1
+    except OSError:
+        return 0
+    return count
+
+
+def parse_json_bytes(buffer) -> Any:
+    """直接从字节（bytes / memoryview）解析 JSON"""
+    if orjson is not None:
+        return orjson.loads(buffer)
+    return json.loads(bytes(buffer) if isinstance(buffer, memoryview) else buffer)
+
+
+def file_signature(file_path: str) -> Tuple[int, int]:
+    """数据文件的 (大小, 修改时间)，用于判断派生文件是否过期"""
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def build_line_index(data_path: str) -> array:
+    """扫描数据文件，生成每个非空行起始字节偏移的索引文件"""
+    signature = file_signature(data_path)
+    offsets = array('Q')
+    position = 0
+    with open(data_path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                offsets.append(position)
+            position += len(line)
+    
+    # 先写临时文件再替换，避免并发读到半个索引；目录不可写时只在内存中使用
+    index_path = data_path + LINE_INDEX_SUFFIX
+    tmp_path = f"{index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(LINE_INDEX_MAGIC)
+            array('Q', signature).tofile(f)
+            offsets.tofile(f)
+        os.replace(tmp_path, index_path)
+    except OSError:
+        pass
+    return offsets
+
+
+def _read_line_index(data_path: str, signature: Tuple[int, int]) -> Optional[array]:
+    """读取索引文件，不存在或与数据文件不匹配时返回 None"""
+    index_path = data_path + LINE_INDEX_SUFFIX
+    try:
+        with open(index_path, 'rb') as f:
+            if f.read(len(LINE_INDEX_MAGIC)) != LINE_INDEX_MAGIC:
+                return None
+            header = array('Q')
+            header.fromfile(f, 2)
+            if tuple(header) != signature:
+                return None
+            offsets = array('Q')
+            offsets.frombytes(f.read())
+            return offsets
+    except (OSError, EOFError, ValueError):
+        return None
+
+
+# 进程内已加载的行偏移索引 {data_path: (signature, offsets)}
+_line_index_cache: Dict[str, Tuple[Tuple[int, int], array]] = {}
+_line_index_lock = threading.Lock()
+
+
+def get_line_index(data_path: str) -> array:
+    """获取数据文件的行偏移索引，缺失或过期时自动重建"""
+    signature = file_signature(data_path)
+    with _line_index_lock:
+        cached = _line_index_cache.get(data_path)
+    if cached and cached[0] == signature:
+        return cached[1]
+    
+    offsets = _read_line_index(data_path, signature)
+    if offsets is None:
+        offsets = build_line_index(data_path)
+    
+    with _line_index_lock:
+        _line_index_cache[data_path] = (signature, offsets)
+    return offsets
+
+
+def get_item_count(data_path: str) -> int:
+    """数据文件中的条目数，通过行偏移索引或帧索引获得"""
+    if compression_of(data_path):
+        return get_frame_index(data_path)[1][-1]
+    return len(get_line_index(data_path))
+
+
+def resolve_range(data_path: str, start: int = 0, end: int = None) -> Tuple[int, int]:
+    """把任务的数据行范围换算成数据文件中的 [start, end)，end 为空表示到文件末尾"""
+    line_count = get_item_count(data_path)
+    start = min(max(start or 0, 0), line_count)
+    end = line_count if end is None else min(max(end, start), line_count)
+    return start, end
+
+
+class MmapJsonlReader:
+    """基于内存映射的 JSONL 读取器
+
+    借助行偏移索引定位每一行，按行切出映射缓冲区的 memoryview 直接解析，
+    不复制整个文件；常驻内存只包含实际访问过的页面。
+    """
+
+    def __init__(self, data_path: str):
+        self.data_path = data_path
+        self.offsets = get_line_index(data_path)
+        self._file = open(data_path, 'rb')
+        self._mmap = None
+        self._view = None
+        if os.fstat(self._file.fileno()).st_size > 0:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._mmap)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        """释放内存映射和文件句柄"""
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def _line_bounds(self, index: int) -> Tuple[int, int]:
+        if index < 0 or index >= len(self.offsets):
+            raise IndexError(f"数据索引越界: {index}（共 {len(self.offsets)} 条）")
+        start = self.offsets[index]
+        end = self._mmap.find(b'\n', start)
+        return start, (len(self._mmap) if end == -1 else end)
+
+    def raw_line(self, index: int) -> memoryview:
+        """返回第 index 行的零拷贝 memoryview，调用方用完后应 release()"""
+        start, end = self._line_bounds(index)
+        return self._view[start:end]
+
+    def __getitem__(self, index: int) -> Any:
+        line = self.raw_line(index)
+        try:
+            return parse_json_bytes(line)
+        finally:
+            line.release()
+
+    def iter_range(self, start: int = 0, end: int = None) -> Iterator[Any]:
+        """按顺序解析 [start, end) 范围内的数据"""
+        end = len(self.offsets) if end is None else min(end, len(self.offsets))
+        for index in range(max(start, 0), end):
+            yield self[index]
+
+    def range_nbytes(self, start: int, end: int) -> int:
+        """[start, end) 范围内数据行的原始字节数"""
+        if start >= end:
+            return 0
+        end_offset = self.offsets[end] if end < len(self.offsets) else len(self._mmap)
+        return end_offset - self.offsets[start]
+
+
+# ---------------------------------------------------------------------------
+# 可随机访问的压缩存储
+# ---------------------------------------------------------------------------
+
+def compression_of(data_path: str) -> Optional[str]:
+    """根据文件后缀判断压缩格式，未压缩时返回 None"""
+    for codec, suffix in COMPRESSION_SUFFIXES.items():
+        if data_path.endswith('.jsonl' + suffix):
+            return codec
+    return None
+
+
+def available_compressions() -> List[str]:
+    """当前环境可用的压缩格式"""
+    return ['gzip'] + (['zstd'] if zstandard is not None else [])
+
+
+def _compress_frame(codec: str, data: bytes) -> bytes:
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+
+def _decompress_frame(codec: str, data: bytes) -> bytes:
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def _new_decompressobj(codec: str):
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(wbits=31)
+
+
+def _write_frame_index(data_path: str, offsets: array, starts: array):
+    """原子写入帧索引文件，目录不可写时忽略"""
+    index_path = data_path + FRAME_INDEX_SUFFIX
+    tmp_path = f"{index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(FRAME_INDEX_MAGIC)
+            array('Q', file_signature(data_path) + (len(offsets),)).tofile(f)
+            offsets.tofile(f)
+            starts.tofile(f)
+        os.replace(tmp_path, index_path)
+    except OSError:
+        pass
+
+
+def _read_frame_index(data_path: str, signature: Tuple[int, int]) -> Optional[Tuple[array, array]]:
+    """读取帧索引文件，不存在或与数据文件不匹配时返回 None"""
+    try:
+        with open(data_path + FRAME_INDEX_SUFFIX, 'rb') as f:
+            if f.read(len(FRAME_INDEX_MAGIC)) != FRAME_INDEX_MAGIC:
+                return None
+            header = array('Q')
+            header.fromfile(f, 3)
+            if tuple(header[:2]) != signature:
+                return None
+            offsets = array('Q')
+            offsets.fromfile(f, header[2])
+            starts = array('Q')
+            starts.fromfile(f, header[2])
+            return offsets, starts
+    except (OSError, EOFError, ValueError):
+        return None
+
+
+def build_frame_index(data_path: str) -> Tuple[array, array]:
+    """扫描压缩文件，逐帧解压以重建帧索引
+
+    返回 (offsets, starts)，两者长度都是帧数 + 1：offsets[k] 为第 k 帧的字节偏移，
+    starts[k] 为第 k 帧第一条数据的序号，最后一个元素分别是文件大小和总条数。
+    """
+    codec = compression_of(data_path)
+    offsets = array('Q', [0])
+    starts = array('Q', [0])
+    consumed = 0
+    items = 0
+    decompressor = _new_decompressobj(codec)
+    with open(data_path, 'rb') as f:
+        pending = b''
+        while True:
+            chunk = pending or f.read(UPLOAD_CHUNK_SIZE)
+            pending = b''
+            if not chunk:
+                break
+            items += decompressor.decompress(chunk).count(b'\n')
+            if decompressor.eof:
+                # 当前帧结束，剩余字节属于下一帧
+                pending = decompressor.unused_data
+                consumed += len(chunk) - len(pending)
+                offsets.append(consumed)
+                starts.append(items)
+                decompressor = _new_decompressobj(codec)
+            else:
+                consumed += len(chunk)
+    _write_frame_index(data_path, offsets, starts)
+    return offsets, starts
+
+
+# 进程内已加载的帧索引 {data_path: (signature, (offsets, starts))}
+_frame_index_cache: Dict[str, Tuple[Tuple[int, int], Tuple[array, array]]] = {}
+
+
+def get_frame_index(data_path: str) -> Tuple[array, array]:
+    """获取压缩文件的帧索引，缺失或过期时自动重建"""
+    signature = file_signature(data_path)
+    with _line_index_lock:
+        cached = _frame_index_cache.get(data_path)
+    if cached and cached[0] == signature:
+        return cached[1]
+    
+    index = _read_frame_index(data_path, signature)
+    if index is None:
+        index = build_frame_index(data_path)
+    
+    with _line_index_lock:
+        _frame_index_cache[data_path] = (signature, index)
+    return index
+
+
+def compress_jsonl(src_path: str, dst_path: str, codec: str,
+                   frame_lines: int = COMPRESSED_FRAME_LINES):
+    """把 JSONL 文件按每 frame_lines 行一帧独立压缩写入 dst_path，并生成帧索引
+
+    只保留非空行，每行以换行符结尾。
+    """
+    if codec not in available_compressions():
+        raise ValueError(f"不支持的压缩格式: {codec}")
+    
+    offsets = array('Q', [0])
+    starts = array('Q', [0])
+    tmp_path = f"{dst_path}.{os.getpid()}.tmp"
+    items = 0
+    with open(src_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+        frame = []
+        
+        def flush_frame():
+            nonlocal items
+            dst.write(_compress_frame(codec, b''.join(frame)))
+            items += len(frame)
+            offsets.append(dst.tell())
+            starts.append(items)
+            frame.clear()
+        
+        for line in src:
+            if not line.strip():
+                continue
+            frame.append(line if line.endswith(b'\n') else line + b'\n')
+            if len(frame) >= frame_lines:
+                flush_frame()
+        if frame:
+            flush_frame()
+    
+    os.replace(tmp_path, dst_path)
+    _write_frame_index(dst_path, offsets, starts)
+
+
+class CompressedJsonlReader:
+    """分帧压缩 JSONL 文件的读取器，接口与 MmapJsonlReader 相同
+
+    借助帧索引只解压目标条目所在的帧，并保留最近解压的一帧供顺序读取复用。
+    """
+
+    def __init__(self, data_path: str):
+        self.data_path = data_path
+        self.codec = compression_of(data_path)
+        self.frame_offsets, self.frame_starts = get_frame_index(data_path)
+        self._file = open(data_path, 'rb')
+        self._frame_no = None
+        self._frame_lines: List[bytes] = []
+
+    def __len__(self) -> int:
+        return self.frame_starts[-1]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        """释放文件句柄和已解压的帧"""
+        self._frame_lines = []
+        self._file.close()
+
+    def _load_frame(self, frame_no: int) -> List[bytes]:
+        if frame_no != self._frame_no:
+            start = self.frame_offsets[frame_no]
+            self._file.seek(start)
+            data = _decompress_frame(self.codec, self._file.read(self.frame_offsets[frame_no + 1] - start))
+            self._frame_lines = data.split(b'\n')[:-1]
+            self._frame_no = frame_no
+        return self._frame_lines
+
+    def raw_line(self, index: int) -> memoryview:
+        """返回第 index 行解压后的内容"""
+        if index < 0 or index >= len(self):
+            raise IndexError(f"数据索引越界: {index}（共 {len(self)} 条）")
+        frame_no = bisect.bisect_right(self.frame_starts, index) - 1
+        return memoryview(self._load_frame(frame_no)[index - self.frame_starts[frame_no]])
+
+    def __getitem__(self, index: int) -> Any:
+        return parse_json_bytes(self.raw_line(index))
+
+    def iter_range(self, start: int = 0, end: int = None) -> Iterator[Any]:
+        """按顺序解析 [start, end) 范围内的数据"""
+        end = len(self) if end is None else min(end, len(self))
+        for index in range(max(start, 0), end):
+            yield self[index]
+
+    def range_nbytes(self, start: int, end: int) -> int:
+        """[start, end) 范围内数据行解压后的字节数"""
+        return sum(len(self.raw_line(index)) + 1 for index in range(start, end))
+
+
+def open_reader(data_path: str):
+    """按文件格式返回 MmapJsonlReader 或 CompressedJsonlReader"""
+    if compression_of(data_path):
+        return CompressedJsonlReader(data_path)
+    return MmapJsonlReader(data_path)
+
+
+class DatasetCache:
+    """进程级共享的任务数据缓存
+
+    以 (data_path, 文件大小, 修改时间, 页号) 为键缓存解析好的条目页，
+    所有会话共用同一份数据；超出字节预算时按 LRU 淘汰。
+    数据文件被修改后签名变化，旧页自然失效并被淘汰。
+    """
+
+    def __init__(self, max_bytes: int = DATASET_CACHE_MAX_BYTES, page_size: int = DATASET_PAGE_SIZE):
+        self.max_bytes = max_bytes
+        self.page_size = page_size
+        self._pages: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _load_page(self, data_path: str, page_no: int) -> Tuple[List[Any], int]:
+        start = page_no * self.page_size
+        with open_reader(data_path) as reader:
+            end = min(start + self.page_size, len(reader))
+            items = list(reader.iter_range(start, end))
+            return items, reader.range_nbytes(start, end)
+
+    def _get_page(self, data_path: str, page_no: int) -> List[Any]:
+        signature = file_signature(data_path)
+        key = (data_path, signature, page_no)
+        with self._lock:
+            entry = self._pages.get(key)
+            if entry is not None:
+                self._pages.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        
+        items, size = self._load_page(data_path, page_no)
+        
+        with self._lock:
+            if key not in self._pages:
+                self._pages[key] = (items, size)
+                self.current_bytes += size
+            while self.current_bytes > self.max_bytes and len(self._pages) > 1:
+                _, (_, evicted_size) = self._pages.popitem(last=False)
+                self.current_bytes -= evicted_size
+        return items
+
+    def get_item(self, data_path: str, index: int) -> Any:
+        """读取一条数据"""
+        total = get_item_count(data_path)
+        if index < 0 or index >= total:
+            raise IndexError(f"数据索引越界: {index}（共 {total} 条）")
+        page = self._get_page(data_path, index // self.page_size)
+        return page[index % self.page_size]
+
+    def iter_items(self, data_path: str, start: int = 0, end: int = None) -> Iterator[Any]:
+        """按顺序遍历 [start, end) 范围内的数据"""
+        total = get_item_count(data_path)
+        end = total if end is None else min(end, total)
+        index = max(start, 0)
+        while index < end:
+            page_no = index // self.page_size
+            page = self._get_page(data_path, page_no)
+            page_start = page_no * self.page_size
+            for item in page[index - page_start:end - page_start]:
+                yield item
+            index = page_start + self.page_size
+
+    def stats(self) -> Dict[str, int]:
+        """缓存命中统计"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'pages': len(self._pages),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+_dataset_cache = None
+_dataset_cache_lock = threading.Lock()
+
+
+def get_dataset_cache() -> DatasetCache:
+    """获取进程级数据缓存"""
+    global _dataset_cache
+    with _dataset_cache_lock:
+        if _dataset_cache is None:
+            _dataset_cache = DatasetCache()
+        return _dataset_cache
+
+
+# ---------------------------------------------------------------------------
+# 会话级后台预取
+# ---------------------------------------------------------------------------
+
+class SessionPrefetcher:
+    """单个会话的后台预取器
+
+    标注者停留在第 i 条时，后台线程读取第 i+1..i+k 条数据及其引用的图片/PDF，
+    放入有界缓存；翻页时页面先查缓存，命中时不再等待磁盘读取。
+    新的调度会取代尚未完成的旧调度，缓存超出字节预算时按 LRU 淘汰。
+    media_resolver 把引用的文件路径映射为实际显示的文件（如图片缩略图），缓存以映射后的路径为键；
+    返回 None 表示该文件不需要预取。
+    """
+
+    def __init__(self, ahead: int = PREFETCH_AHEAD, max_bytes: int = PREFETCH_MAX_BYTES,
+                 media_resolver: Callable[[str], str] = None):
+        self.ahead = ahead
+        self.max_bytes = max_bytes
+        self.media_resolver = media_resolver
+        self._items: OrderedDict = OrderedDict()   # (data_path, index) -> item
+        self._media: OrderedDict = OrderedDict()   # full_path -> (signature, bytes)
+        self._media_bytes = 0
+        self._plan: List[Tuple[str, Any]] = []
+        self._generation = 0
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self.hits = 0
+        self.misses = 0
+
+    def schedule(self, data_path: str, start: int, end: int,
+                 media_fields: List[str] = None, base_path: str = ''):
+        """预取 [start, end) 范围内的数据（最多 ahead 条）及其 media_fields 字段引用的文件"""
+        plan = [('item', (data_path, index, media_fields or [], base_path))
+                for index in range(max(start, 0), min(end, start + self.ahead))]
+        with self._cond:
+            self._plan = plan
+            self._generation += 1
+            self._cond.notify()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='session-prefetch', daemon=True)
+                self._thread.start()
+
+    def get_item(self, data_path: str, index: int) -> Optional[Any]:
+        """从预取缓存读取一条数据，未命中时返回 None"""
+        with self._cond:
+            item = self._items.get((data_path, index))
+            if item is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return item
+
+    def get_media(self, full_path: str) -> Optional[bytes]:
+        """从预取缓存读取文件内容，未命中或文件已变化时返回 None"""
+        with self._cond:
+            entry = self._media.get(full_path)
+        if entry is None:
+            return None
+        try:
+            if entry[0] != file_signature(full_path):
+                return None
+        except OSError:
+            return None
+        with self._cond:
+            if full_path in self._media:
+                self._media.move_to_end(full_path)
+        return entry[1]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._plan:
+                    self._cond.wait(PREFETCH_IDLE_SECONDS)
+                    if not self._plan:
+                        self._thread = None
+                        return
+                generation = self._generation
+                kind, args = self._plan.pop(0)
+            try:
+                if kind == 'item':
+                    self._prefetch_item(generation, *args)
+                else:
+                    self._prefetch_media(args)
+            except Exception:
+                # 预取失败不影响页面，真正读取时会重新报错
+                pass
+
+    def _prefetch_item(self, generation: int, data_path: str, index: int,
+                       media_fields: List[str], base_path: str):
+        key = (data_path, index)
+        with self._cond:
+            item = self._items.get(key)
+        if item is None:
+            item = get_dataset_cache().get_item(data_path, index)
+            with self._cond:
+                self._items[key] = item
+                # 条目本身由进程级数据缓存共享，这里只保留少量引用
+                while len(self._items) > self.ahead * 4:
+                    self._items.popitem(last=False)
+        
+        if not isinstance(item, dict):
+            return
+        with self._cond:
+            if generation != self._generation:
+                return
+            # 引用的文件排在其余条目之前，保证下一条完整可用
+            for field in reversed(media_fields):
+                value = item.get(field)
+                if isinstance(value, str) and value:
+                    full_path = os.path.join(base_path, value) if base_path else value
+                    self._plan.insert(0, ('media', full_path))
+
+    def _prefetch_media(self, full_path: str):
+        if self.media_resolver is not None:
+            full_path = self.media_resolver(full_path)
+            if full_path is None:
+                return
+        with self._cond:
+            if full_path in self._media:
+                return
+        signature = file_signature(full_path)
+        if signature[0] > self.max_bytes // 4:
+            # 单个过大的文件不预取，避免挤掉其他缓存
+            return
+        with open(full_path, 'rb') as f:
+            content = f.read()
+        with self._cond:
+            if full_path in self._media:
+                return
+            self._media[full_path] = (signature, content)
+            self._media_bytes += len(content)
+            while self._media_bytes > self.max_bytes and len(self._media) > 1:
+                _, (_, evicted) = self._media.popitem(last=False)
+                self._media_bytes -= len(evicted)
+
+    def stats(self) -> Dict[str, int]:
+        """预取缓存命中统计"""
+        with self._cond:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'items': len(self._items),
+                'media': len(self._media),
+                'bytes': self._media_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+# ---------------------------------------------------------------------------
+# 任务拆分
+# ---------------------------------------------------------------------------
+
+# 近似的词元切分：中日韩文字逐字计数，其余按单词和标点计数
+_TOKEN_PATTERN = re.compile(r'[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]|\w+|[^\w\s]')
+_token_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """统计文本词元数，安装了 tiktoken 时使用 cl100k_base 编码，否则近似计算"""
+    global _token_encoding
+    if tiktoken is not None and _token_encoding is None:
+        try:
+            _token_encoding = tiktoken.get_encoding('cl100k_base')
+        except Exception:
+            # 编码文件下载失败等情况，后续都使用近似切分
+            _token_encoding = False
+    if _token_encoding:
+        return len(_token_encoding.encode(text, disallowed_special=()))
+    return len(_TOKEN_PATTERN.findall(text))
+
+# 最近一次计算的条目开销前缀和，切换拆分数量时无需重新扫描文件
+_cost_prefix_cache: Dict[Tuple, array] = {}
+_cost_prefix_lock = threading.Lock()
+
+
+def _item_cost(item: Any, fields: Optional[List[str]], unit: str) -> int:
+    """一条数据的开销：所选字段的字符数或近似词元数"""
+    if isinstance(item, dict):
+        values = [item.get(field) for field in fields] if fields else list(item.values())
+    else:
+        values = [item]
+    cost = 0
+    for value in values:
+        if value is None:
+            continue
+        text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+        cost += count_tokens(text) if unit == 'tokens' else len(text)
+    return cost
+
+
+def item_cost_prefix(data_path: str, fields: List[str] = None, unit: str = 'chars') -> array:
+    """单次流式扫描数据文件，返回条目开销的前缀和（长度为条目数 + 1）
+
+    unit 为 'chars'（字符数）或 'tokens'（近似词元数），fields 为空时统计所有字段。
+    """
+    key = (data_path, file_signature(data_path), tuple(fields or ()), unit)
+    with _cost_prefix_lock:
+        cached = _cost_prefix_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    prefix = array('Q', [0])
+    total = 0
+    with open_reader(data_path) as reader:
+        for item in reader.iter_range():
+            # 每条至少计 1，空内容的条目也会占用标注时间
+            total += max(_item_cost(item, fields, unit), 1)
+            prefix.append(total)
+    
+    with _cost_prefix_lock:
+        _cost_prefix_cache.clear()
+        _cost_prefix_cache[key] = prefix
+    return prefix
+
+
+def even_split_bounds(total_items: int, num_splits: int) -> List[Tuple[int, int]]:
+    """按条数均分，返回每个子任务的 [start, end)；拆分数不超过数据条数，每段至少包含一条数据"""
+    num_splits = max(1, min(num_splits, total_items))
+    base_size, remainder = divmod(total_items, num_splits)
+    bounds = []
+    start = 0
+    for split_idx in range(num_splits):
+        end = start + base_size + (1 if split_idx < remainder else 0)
+        bounds.append((start, end))
+        start = end
+    return bounds
+
+
+def balanced_split_bounds(prefix: array, num_splits: int) -> List[Tuple[int, int]]:
+    """按开销前缀和把数据切成 num_splits 段连续范围，使各段开销尽量接近
+
+    在前缀和上二分查找每个切分点，复杂度 O(num_splits * log n)；每段至少包含一条数据。
+    """
+    total_items = len(prefix) - 1
+    num_splits = max(1, min(num_splits, total_items))
+    total_cost = prefix[-1]
+    bounds = []
+    start = 0
+    for split_idx in range(1, num_splits):
+        target = total_cost * split_idx / num_splits
+        end = bisect.bisect_left(prefix, target)
+        # 取离目标更近的切分点
+        if end > 0 and target - prefix[end - 1] < prefix[min(end, total_items)] - target:
+            end -= 1
+        end = min(max(end, start + 1), total_items - (num_splits - split_idx))
+        bounds.append((start, end))
+        start = end
+    bounds.append((start, total_items))
+    return bounds
+
+
+# ---------------------------------------------------------------------------
+# 上传文件流式暂存
+# ---------------------------------------------------------------------------
+
+def new_staging_path() -> str:
+    """生成新的暂存文件路径，并顺带清理过期的暂存文件"""
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    now = time.time()
+    for name in os.listdir(STAGING_DIR):
+        path = os.path.join(STAGING_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > STAGING_MAX_AGE_SECONDS:
+                os.remove(path)
+        except OSError:
+            pass
+    return os.path.join(STAGING_DIR, f"upload_{os.getpid()}_{time.time_ns()}.jsonl")
+
+
+def stage_jsonl_upload(stream: BinaryIO, staging_path: str, total_size: int = None,
+                       progress_callback: Callable[[int, int], None] = None,
+                       sample_size: int = 5, validate: bool = True) -> Dict[str, Any]:
+    """把上传的 JSONL 分块写入暂存文件，同时逐行解析校验
+
+    不会把整个文件读入内存，只保留前 sample_size 条数据作为样例。
+    返回 {'count', 'sample', 'error', 'sha256'}，error 为第一处格式错误（行号从 1 开始），
+    没有错误时为 None。validate=False 时只写入文件，之后可用 parse_jsonl_parallel 校验。
+    sha256 在写入时顺带计算，供内容寻址存储直接使用。
+    """
+    digest = hashlib.sha256()
+    count = 0
+    sample = []
+    error = None
+    line_no = 0
+    bytes_done = 0
+    pending = b''
+    
+    def check_line(line: bytes):
+        nonlocal count, error
+        if not line.strip():
+            return
+        try:
+            item = parse_json_bytes(line)
+        except ValueError as e:
+            error = {'line': line_no, 'message': str(e)}
+            return
+        count += 1
+        if len(sample) < sample_size:
+            sample.append(item)
+    
+    with open(staging_path, 'wb') as out:
+        while error is None:
+            chunk = stream.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            out.write(chunk)
+            digest.update(chunk)
+            bytes_done += len(chunk)
+            if not validate:
+                if progress_callback:
+                    progress_callback(bytes_done, total_size or bytes_done)
+                continue
+            
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                line_no += 1
+                check_line(line)
+                if error is not None:
+                    break
+            
+            if progress_callback:
+                progress_callback(bytes_done, total_size or bytes_done)
+        
+        if error is None and pending:
+            line_no += 1
+            check_line(pending)
+    
+    return {'count': count, 'sample': sample, 'error': error, 'sha256': digest.hexdigest()}
+
+
+def _split_line_chunks(data_path: str, chunk_bytes: int) -> List[Tuple[int, int]]:
+    """把文件切成若干 [start, end) 字节范围，每个范围都在换行符处结束"""
+    size = os.path.getsize(data_path)
+    chunks = []
+    start = 0
+    with open(data_path, 'rb') as f:
+        while start < size:
+            end = start + chunk_bytes
+            if end >= size:
+                end = size
+            else:
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+def _parse_line_chunk(data_path: str, start: int, end: int, sample_size: int) -> Dict[str, Any]:
+    """解析一个字节范围内的所有行（在子进程中执行）
+
+    返回该范围的物理行数、有效条数、样例和第一处错误（行号相对于范围起点）。
+    """
+    with open(data_path, 'rb') as f:
+        f.seek(start)
+        buffer = f.read(end - start)
+    
+    lines = buffer.split(b'\n')
+    if lines and lines[-1] == b'':
+        lines.pop()
+    count = 0
+    sample = []
+    for line_no, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            item = parse_json_bytes(line)
+        except ValueError as e:
+            return {'lines': len(lines), 'count': count, 'sample': sample,
+                    'error': {'line': line_no, 'message': str(e)}}
+        count += 1
+        if len(sample) < sample_size:
+            sample.append(item)
+    return {'lines': len(lines), 'count': count, 'sample': sample, 'error': None}
+
+
+def parse_jsonl_parallel(data_path: str, max_workers: int = None,
+                         chunk_bytes: int = PARALLEL_PARSE_CHUNK_BYTES,
+                         progress_callback: Callable[[int, int], None] = None,
+                         sample_size: int = 5) -> Dict[str, Any]:
+    """按行边界切分文件，在进程池中并行解析校验
+
+    返回值与 stage_jsonl_upload 相同：{'count', 'sample', 'error'}，
+    error 的行号是整个文件中的行号。进程池不可用时退化为在当前进程中逐块解析。
+    """
+    chunks = _split_line_chunks(data_path, chunk_bytes)
+    total_bytes = chunks[-1][1] if chunks else 0
+    results: List[Optional[Dict[str, Any]]] = [None] * len(chunks)
+    done_bytes = 0
+    
+    def collect(position: int, result: Dict[str, Any]):
+        nonlocal done_bytes
+        results[position] = result
+        done_bytes += chunks[position][1] - chunks[position][0]
+        if progress_callback:
+            progress_callback(done_bytes, total_bytes)
+    
+    # Streamlit 服务进程是多线程的，在其中 fork 可能死锁；
+    # 改用 forkserver（不支持时用 spawn），子进程只需导入不依赖 Streamlit 的本模块
+    start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 mp_context=multiprocessing.get_context(start_method)) as executor:
+            futures = {
+                executor.submit(_parse_line_chunk, data_path, start, end, sample_size): position
+                for position, (start, end) in enumerate(chunks)
+            }
+            for future in as_completed(futures):
+                collect(futures[future], future.result())
+    except (OSError, NotImplementedError, BrokenProcessPool):
+        # 受限环境中无法创建子进程，或子进程异常退出
+        for position, (start, end) in enumerate(chunks):
+            if results[position] is None:
+                collect(position, _parse_line_chunk(data_path, start, end, sample_size))
+    
+    # 按分块顺序汇总，把分块内的行号换算成全局行号
+    count = 0
+    sample = []
+    line_base = 0
+    for result in results:
+        count += result['count']
+        sample.extend(result['sample'][:sample_size - len(sample)])
+        if result['error'] is not None:
+            error = dict(result['error'], line=line_base + result['error']['line'])
+            return {'count': count, 'sample': sample, 'error': error}
+        line_base += result['lines']
+    return {'count': count, 'sample': sample, 'error': None}
+
+
+def hash_file(file_path: str) -> str:
+    """流式计算文件内容的 sha256"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def blob_path(sha256: str, suffix: str = '.jsonl') -> str:
+    """内容哈希对应的数据文件路径"""
+    return os.path.join(BLOB_DIR, sha256 + suffix)
+
+
+def blob_sha256(data_path: str) -> Optional[str]:
+    """数据文件位于内容寻址目录时返回其 sha256，否则返回 None"""
+    if not data_path or os.path.normpath(os.path.dirname(data_path)) != os.path.normpath(BLOB_DIR):
+        return None
+    sha256 = os.path.basename(data_path).split('.', 1)[0]
+    return sha256 if len(sha256) == SHA256_HEX_LENGTH else None
+
+
+def store_blob(staging_path: str, sha256: str = None, compression: str = None) -> str:
+    """把暂存文件按内容哈希存放到 data/blobs/<sha256>.jsonl[.gz|.zst]，返回数据文件路径
+
+    哈希按未压缩的内容计算；相同内容已经以任意格式存在时直接丢弃暂存文件，复用已有文件。
+    """
+    sha256 = sha256 or hash_file(staging_path)
+    for suffix in [''] + list(COMPRESSION_SUFFIXES.values()):
+        existing = blob_path(sha256, '.jsonl' + suffix)
+        if os.path.exists(existing):
+            os.remove(staging_path)
+            return existing
+    
+    if compression:
+        target = blob_path(sha256, '.jsonl' + COMPRESSION_SUFFIXES[compression])
+        os.makedirs(BLOB_DIR, exist_ok=True)
+        compress_jsonl(staging_path, target, compression)
+        os.remove(staging_path)
+    else:
+        target = blob_path(sha256)
+        move_into_place(staging_path, target)
+    return target
+
+
+def remove_blob(data_path: str) -> int:
+    """删除数据文件及其行偏移索引，返回释放的字节数"""
+    freed = 0
+    for path in (data_path, data_path + LINE_INDEX_SUFFIX, data_path + FRAME_INDEX_SUFFIX):
+        try:
+            freed += os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            pass
+    with _line_index_lock:
+        _line_index_cache.pop(data_path, None)
+        _frame_index_cache.pop(data_path, None)
+    return freed
+
+
+def move_into_place(staging_path: str, data_path: str):
+    """把暂存文件移动到正式的数据路径"""
+    os.makedirs(os.path.dirname(data_path) or '.', exist_ok=True)
+    shutil.move(staging_path, data_path)
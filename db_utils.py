@@ -0,0 +1,849 @@
+"""
+数据库基础设施
+提供进程级共享的 SQLite 连接池和版本化的数据库迁移
+
+Streamlit 每次 rerun 都会重新执行 streamlit_app.py，
+因此需要跨 rerun 存活的状态（如连接池）放在这个独立模块中。
+"""
+
+import os
+import json
+import sqlite3
+import threading
+import queue
+import atexit
+import sys
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import data_store
+
+DEFAULT_DB_PATH = 'annotation_platform.db'
+
+# 每个新连接建立时执行一次的 PRAGMA
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',        # 读写并发，写入不阻塞读取
+    'busy_timeout': 5000,         # 遇到写锁时最多等待 5 秒
+    'synchronous': 'NORMAL',      # WAL 模式下安全且避免每次提交都 fsync
+    'cache_size': -20000,         # 约 20MB 页缓存（负数单位为 KB）
+    'mmap_size': 268435456,       # 256MB 内存映射读取
+    'temp_store': 'MEMORY',
+}
+
+# 连接池中最多保留的空闲连接数
+POOL_MAX_IDLE = 16
+
+
+class PooledConnection:
+    """连接池中的连接
+
+    行为与 sqlite3.Connection 一致，只是 close() 会把连接归还连接池而不是真正关闭，
+    因此现有的 `conn = get_connection() ... conn.close()` 写法无需修改。
+    """
+
+    def __init__(self, pool: 'ConnectionPool', raw: sqlite3.Connection):
+        self._pool = pool
+        self._raw = raw
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __enter__(self):
+        return self._raw.__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._raw.__exit__(exc_type, exc, tb)
+
+    def close(self):
+        """归还连接到连接池"""
+        if self._raw is not None:
+            self._pool.release(self._raw)
+            self._raw = None
+
+
+class ConnectionPool:
+    """基于队列的 SQLite 连接池"""
+
+    def __init__(self, db_path: str, max_idle: int = POOL_MAX_IDLE):
+        self.db_path = db_path
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+
+    def _create_connection(self) -> sqlite3.Connection:
+        # 连接会在不同的 Streamlit 会话线程间复用，但同一时刻只被一个线程持有
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        for pragma, value in SQLITE_PRAGMAS.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        return conn
+
+    def acquire(self) -> PooledConnection:
+        """从连接池获取连接，没有空闲连接时新建"""
+        try:
+            raw = self._idle.get_nowait()
+        except queue.Empty:
+            raw = self._create_connection()
+        return PooledConnection(self, raw)
+
+    def release(self, raw: sqlite3.Connection):
+        """归还连接，未提交的事务会被回滚"""
+        try:
+            if raw.in_transaction:
+                raw.rollback()
+            self._idle.put_nowait(raw)
+        except (queue.Full, sqlite3.Error):
+            raw.close()
+
+    def close_all(self):
+        """关闭所有空闲连接"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str = DEFAULT_DB_PATH) -> ConnectionPool:
+    """获取指定数据库文件的进程级连接池"""
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None:
+            pool = ConnectionPool(db_path)
+            _pools[db_path] = pool
+        return pool
+
+
+def get_connection(db_path: str = DEFAULT_DB_PATH) -> PooledConnection:
+    """从连接池获取一个连接"""
+    return get_pool(db_path).acquire()
+
+
+# 依赖 (task_id, annotator_id, data_index) 唯一索引，一条语句完成插入或更新
+# 参数顺序: (id, task_id, data_index, result, annotator_id)
+UPSERT_ANNOTATION_SQL = '''
+    INSERT INTO annotations (id, task_id, data_index, result, annotator_id)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (task_id, annotator_id, data_index)
+    DO UPDATE SET result = excluded.result, updated_at = CURRENT_TIMESTAMP
+'''
+
+
+# SQL IN (...) 子句单批最多绑定的参数数量，低于 SQLite 的变量数上限
+SQL_IN_BATCH_SIZE = 500
+
+
+def chunked(items: List, size: int = SQL_IN_BATCH_SIZE) -> Iterator[List]:
+    """把列表按固定大小切分，用于拼接 IN (...) 查询"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def rebuild_task_progress(conn):
+    """根据 annotations 表批量重建 task_progress 计数（不提交事务）"""
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM task_progress')
+    cursor.execute('''
+        INSERT INTO task_progress (task_id, annotator_id, completed, updated_at)
+        SELECT task_id, annotator_id, COUNT(*), CURRENT_TIMESTAMP
+        FROM annotations
+        GROUP BY task_id, annotator_id
+    ''')
+
+
+def verify_task_progress(conn) -> List[Dict]:
+    """对比 task_progress 计数与 annotations 实际数量，返回不一致的记录"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT task_id, annotator_id, SUM(actual), SUM(recorded)
+        FROM (
+            SELECT task_id, annotator_id, COUNT(*) AS actual, 0 AS recorded
+            FROM annotations
+            GROUP BY task_id, annotator_id
+            UNION ALL
+            SELECT task_id, annotator_id, 0 AS actual, completed AS recorded
+            FROM task_progress
+        )
+        GROUP BY task_id, annotator_id
+        HAVING SUM(actual) != SUM(recorded)
+    ''')
+    return [
+        {'task_id': row[0], 'annotator_id': row[1], 'actual': row[2], 'recorded': row[3]}
+        for row in cursor.fetchall()
+    ]
+
+
+def rebuild_annotation_runs(conn):
+    """根据 annotations 表批量重建已保存索引的连续区间（不提交事务）"""
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM annotation_runs')
+    # gaps-and-islands：连续索引减去其序号后的差值相同
+    cursor.execute('''
+        INSERT INTO annotation_runs (task_id, annotator_id, run_start, run_end)
+        SELECT task_id, annotator_id, MIN(data_index), MAX(data_index) + 1
+        FROM (
+            SELECT task_id, annotator_id, data_index,
+                   data_index - ROW_NUMBER() OVER (
+                       PARTITION BY task_id, annotator_id ORDER BY data_index
+                   ) AS grp
+            FROM annotations
+            WHERE data_index IS NOT NULL
+        )
+        GROUP BY task_id, annotator_id, grp
+    ''')
+
+
+def rebuild_annotator_daily_counts(conn):
+    """根据 annotations 表批量重建 annotator_daily_counts 汇总（不提交事务）"""
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM annotator_daily_counts')
+    cursor.execute('''
+        INSERT INTO annotator_daily_counts
+            (annotator_id, day, task_id, annotation_count, first_annotation, last_annotation)
+        SELECT annotator_id, DATE(created_at), task_id, COUNT(*), MIN(created_at), MAX(created_at)
+        FROM annotations
+        GROUP BY annotator_id, DATE(created_at), task_id
+    ''')
+
+
+# 登记内容寻址的数据文件，引用计数由 tasks 表上的触发器维护
+# 参数顺序: (sha256, path, size)
+REGISTER_BLOB_SQL = '''
+    INSERT OR IGNORE INTO data_blobs (sha256, path, size) VALUES (?, ?, ?)
+'''
+
+
+def rebuild_data_blob_refs(conn):
+    """登记任务引用的内容寻址数据文件并重算引用计数（不提交事务）"""
+    cursor = conn.cursor()
+    cursor.execute('SELECT DISTINCT data_path FROM tasks')
+    for (data_path,) in cursor.fetchall():
+        sha256 = data_store.blob_sha256(data_path)
+        if sha256 and os.path.exists(data_path):
+            cursor.execute(REGISTER_BLOB_SQL, (sha256, data_path, os.path.getsize(data_path)))
+    cursor.execute('''
+        UPDATE data_blobs
+        SET ref_count = (SELECT COUNT(*) FROM tasks WHERE tasks.data_path = data_blobs.path)
+    ''')
+
+
+def collect_unreferenced_blobs(conn) -> Tuple[int, int]:
+    """删除引用计数为 0 的数据文件，返回 (文件数, 释放字节数)"""
+    cursor = conn.cursor()
+    cursor.execute('SELECT sha256, path FROM data_blobs WHERE ref_count <= 0')
+    rows = cursor.fetchall()
+    freed = 0
+    for sha256, path in rows:
+        freed += data_store.remove_blob(path)
+        cursor.execute('DELETE FROM data_blobs WHERE sha256 = ? AND ref_count <= 0', (sha256,))
+    conn.commit()
+    return len(rows), freed
+
+
+# ---------------------------------------------------------------------------
+# 数据库迁移
+#
+# 每个迁移步骤在单独的事务中执行，成功后写入 schema_version 表。
+# 步骤均按幂等方式编写（IF NOT EXISTS、先检查列是否存在），
+# 因此旧版本应用创建的数据库也能安全地从头补齐。
+# ---------------------------------------------------------------------------
+
+def _add_missing_columns(cursor, table: str, columns: Dict[str, str]):
+    """为表补充缺失的列"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    existing = {row[1] for row in cursor.fetchall()}
+    for column, declaration in columns.items():
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+
+def _migration_base_schema(cursor):
+    """基础表结构：任务、标注、用户、任务分配"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tasks (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            description TEXT,
+            config TEXT,
+            status TEXT DEFAULT 'created',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            data_path TEXT,
+            task_label TEXT,
+            parent_task_id TEXT,
+            split_index INTEGER DEFAULT 0,
+            total_splits INTEGER DEFAULT 1
+        )
+    ''')
+    _add_missing_columns(cursor, 'tasks', {
+        'task_label': 'TEXT',
+        'parent_task_id': 'TEXT',
+        'split_index': 'INTEGER DEFAULT 0',
+        'total_splits': 'INTEGER DEFAULT 1',
+    })
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS annotations (
+            id TEXT PRIMARY KEY,
+            task_id TEXT,
+            data_index INTEGER,
+            result TEXT,
+            status TEXT DEFAULT 'pending',
+            annotator_id TEXT DEFAULT 'user1',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (task_id) REFERENCES tasks (id)
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            email TEXT UNIQUE,
+            role TEXT DEFAULT 'annotator',
+            full_name TEXT,
+            is_active BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_login TIMESTAMP
+        )
+    ''')
+    _add_missing_columns(cursor, 'users', {
+        'full_name': 'TEXT',
+        'password_hash': 'TEXT',
+        'email': 'TEXT',
+        'is_active': 'BOOLEAN DEFAULT 1',
+        'last_login': 'TIMESTAMP',
+    })
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS task_assignments (
+            id TEXT PRIMARY KEY,
+            task_id TEXT NOT NULL,
+            assigned_to TEXT NOT NULL,
+            assigned_by TEXT NOT NULL,
+            assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'assigned',
+            FOREIGN KEY (task_id) REFERENCES tasks (id),
+            FOREIGN KEY (assigned_to) REFERENCES users (id),
+            FOREIGN KEY (assigned_by) REFERENCES users (id)
+        )
+    ''')
+
+
+def _migration_annotation_unique_index(cursor):
+    """标注去重并建立 (task_id, annotator_id, data_index) 唯一索引"""
+    # 同一任务/标注者/数据索引只保留最近更新的一条标注
+    cursor.execute('''
+        DELETE FROM annotations WHERE rowid NOT IN (
+            SELECT rowid FROM (
+                SELECT rowid, ROW_NUMBER() OVER (
+                    PARTITION BY task_id, annotator_id, data_index
+                    ORDER BY updated_at DESC, rowid DESC
+                ) AS rn
+                FROM annotations
+            ) WHERE rn = 1
+        )
+    ''')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_annotations_task_annotator_index
+        ON annotations (task_id, annotator_id, data_index)
+    ''')
+
+
+def _migration_task_item_count(cursor):
+    """持久化任务数据条数，进度计算不再读取数据文件"""
+    _add_missing_columns(cursor, 'tasks', {'item_count': 'INTEGER'})
+    
+    cursor.execute("SELECT id, data_path FROM tasks WHERE item_count IS NULL")
+    for task_id, data_path in cursor.fetchall():
+        cursor.execute(
+            "UPDATE tasks SET item_count = ? WHERE id = ?",
+            (data_store.count_jsonl_items(data_path), task_id)
+        )
+
+
+def _migration_task_progress(cursor):
+    """每个任务/标注者的已完成计数，由触发器在保存标注的同一事务中维护"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS task_progress (
+            task_id TEXT,
+            annotator_id TEXT,
+            completed INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (task_id, annotator_id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_annotations_progress_insert
+        AFTER INSERT ON annotations
+        BEGIN
+            INSERT INTO task_progress (task_id, annotator_id, completed, updated_at)
+            VALUES (NEW.task_id, NEW.annotator_id, 1, CURRENT_TIMESTAMP)
+            ON CONFLICT (task_id, annotator_id)
+            DO UPDATE SET completed = completed + 1, updated_at = CURRENT_TIMESTAMP;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_annotations_progress_delete
+        AFTER DELETE ON annotations
+        BEGIN
+            UPDATE task_progress
+            SET completed = completed - 1, updated_at = CURRENT_TIMESTAMP
+            WHERE task_id = OLD.task_id AND annotator_id = OLD.annotator_id;
+        END
+    ''')
+    rebuild_task_progress(cursor.connection)
+
+
+def _migration_annotator_daily_counts(cursor):
+    """标注者每日/每任务标注数汇总，排行榜和个人统计都从这里读取"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS annotator_daily_counts (
+            annotator_id TEXT,
+            day TEXT,
+            task_id TEXT,
+            annotation_count INTEGER NOT NULL DEFAULT 0,
+            first_annotation TIMESTAMP,
+            last_annotation TIMESTAMP,
+            PRIMARY KEY (annotator_id, day, task_id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_annotator_daily_counts_day
+        ON annotator_daily_counts (day)
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_annotations_daily_insert
+        AFTER INSERT ON annotations
+        BEGIN
+            INSERT INTO annotator_daily_counts
+                (annotator_id, day, task_id, annotation_count, first_annotation, last_annotation)
+            VALUES (NEW.annotator_id, DATE(NEW.created_at), NEW.task_id, 1, NEW.created_at, NEW.created_at)
+            ON CONFLICT (annotator_id, day, task_id)
+            DO UPDATE SET annotation_count = annotation_count + 1,
+                          first_annotation = MIN(first_annotation, excluded.first_annotation),
+                          last_annotation = MAX(last_annotation, excluded.last_annotation);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_annotations_daily_delete
+        AFTER DELETE ON annotations
+        BEGIN
+            UPDATE annotator_daily_counts
+            SET annotation_count = annotation_count - 1
+            WHERE annotator_id = OLD.annotator_id AND day = DATE(OLD.created_at) AND task_id = OLD.task_id;
+        END
+    ''')
+    rebuild_annotator_daily_counts(cursor.connection)
+
+
+def _migration_task_data_range(cursor):
+    """任务数据可以是父数据文件中的一段行范围 [data_start, data_end)，拆分任务不再复制数据"""
+    _add_missing_columns(cursor, 'tasks', {
+        'data_start': 'INTEGER DEFAULT 0',
+        'data_end': 'INTEGER',
+    })
+
+
+def _migration_data_blobs(cursor):
+    """内容寻址的任务数据文件及其引用计数，相同内容的上传和复制的任务共用一个文件"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_blobs (
+            sha256 TEXT PRIMARY KEY,
+            path TEXT UNIQUE NOT NULL,
+            size INTEGER,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_tasks_blob_insert
+        AFTER INSERT ON tasks
+        BEGIN
+            UPDATE data_blobs SET ref_count = ref_count + 1 WHERE path = NEW.data_path;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_tasks_blob_delete
+        AFTER DELETE ON tasks
+        BEGIN
+            UPDATE data_blobs SET ref_count = ref_count - 1 WHERE path = OLD.data_path;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_tasks_blob_update
+        AFTER UPDATE OF data_path ON tasks
+        WHEN OLD.data_path IS NOT NEW.data_path
+        BEGIN
+            UPDATE data_blobs SET ref_count = ref_count - 1 WHERE path = OLD.data_path;
+            UPDATE data_blobs SET ref_count = ref_count + 1 WHERE path = NEW.data_path;
+        END
+    ''')
+    rebuild_data_blob_refs(cursor.connection)
+
+
+def _migration_annotation_runs(cursor):
+    """每个任务/标注者已保存索引的连续区间 [run_start, run_end)，由触发器在保存标注的同一事务中维护
+
+    区间互不重叠也互不相邻，查询某个索引所在区间只需在主键上定位一次。
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS annotation_runs (
+            task_id TEXT,
+            annotator_id TEXT,
+            run_start INTEGER NOT NULL,
+            run_end INTEGER NOT NULL,
+            PRIMARY KEY (task_id, annotator_id, run_start)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_annotation_runs_end
+        ON annotation_runs (task_id, annotator_id, run_end)
+    ''')
+    # 新增索引 i：与前一个区间相接时向后延伸（并吞并紧随其后的区间），
+    # 否则与后一个区间相接时向前延伸，都不相接时新建区间
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_annotations_runs_insert
+        AFTER INSERT ON annotations
+        WHEN NEW.data_index IS NOT NULL
+        BEGIN
+            UPDATE annotation_runs
+            SET run_end = COALESCE(
+                (SELECT run_end FROM annotation_runs
+                 WHERE task_id = NEW.task_id AND annotator_id = NEW.annotator_id
+                   AND run_start = NEW.data_index + 1),
+                NEW.data_index + 1)
+            WHERE task_id = NEW.task_id AND annotator_id = NEW.annotator_id
+              AND run_end = NEW.data_index;
+            DELETE FROM annotation_runs
+            WHERE task_id = NEW.task_id AND annotator_id = NEW.annotator_id
+              AND run_start = NEW.data_index + 1
+              AND (SELECT run_end FROM annotation_runs
+                   WHERE task_id = NEW.task_id AND annotator_id = NEW.annotator_id
+                     AND run_start <= NEW.data_index
+                   ORDER BY run_start DESC LIMIT 1) > NEW.data_index;
+            UPDATE annotation_runs SET run_start = NEW.data_index
+            WHERE task_id = NEW.task_id AND annotator_id = NEW.annotator_id
+              AND run_start = NEW.data_index + 1;
+            INSERT INTO annotation_runs (task_id, annotator_id, run_start, run_end)
+            SELECT NEW.task_id, NEW.annotator_id, NEW.data_index, NEW.data_index + 1
+            WHERE COALESCE(
+                (SELECT run_end FROM annotation_runs
+                 WHERE task_id = NEW.task_id AND annotator_id = NEW.annotator_id
+                   AND run_start <= NEW.data_index
+                 ORDER BY run_start DESC LIMIT 1), NEW.data_index) <= NEW.data_index;
+        END
+    ''')
+    # 删除索引 i：把所在区间拆成 [run_start, i) 和 [i + 1, run_end)，去掉空区间
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_annotations_runs_delete
+        AFTER DELETE ON annotations
+        WHEN OLD.data_index IS NOT NULL
+        BEGIN
+            INSERT INTO annotation_runs (task_id, annotator_id, run_start, run_end)
+            SELECT task_id, annotator_id, OLD.data_index + 1, run_end FROM annotation_runs
+            WHERE task_id = OLD.task_id AND annotator_id = OLD.annotator_id
+              AND run_start = (SELECT run_start FROM annotation_runs
+                               WHERE task_id = OLD.task_id AND annotator_id = OLD.annotator_id
+                                 AND run_start <= OLD.data_index
+                               ORDER BY run_start DESC LIMIT 1)
+              AND run_end > OLD.data_index + 1;
+            UPDATE annotation_runs SET run_end = OLD.data_index
+            WHERE task_id = OLD.task_id AND annotator_id = OLD.annotator_id
+              AND run_start = (SELECT run_start FROM annotation_runs
+                               WHERE task_id = OLD.task_id AND annotator_id = OLD.annotator_id
+                                 AND run_start <= OLD.data_index
+                               ORDER BY run_start DESC LIMIT 1)
+              AND run_end > OLD.data_index;
+            DELETE FROM annotation_runs
+            WHERE task_id = OLD.task_id AND annotator_id = OLD.annotator_id
+              AND run_start = OLD.data_index AND run_end = OLD.data_index;
+        END
+    ''')
+    rebuild_annotation_runs(cursor.connection)
+
+
+# 按版本号顺序执行的迁移步骤，新的结构变更只能追加到末尾
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, '基础表结构', _migration_base_schema),
+    (2, '标注唯一索引', _migration_annotation_unique_index),
+    (3, '任务数据条数', _migration_task_item_count),
+    (4, '任务进度计数表', _migration_task_progress),
+    (5, '标注者每日统计汇总表', _migration_annotator_daily_counts),
+    (6, '任务数据行范围', _migration_task_data_range),
+    (7, '内容寻址数据文件引用计数', _migration_data_blobs),
+    (8, '已保存索引区间表', _migration_annotation_runs),
+]
+
+
+def get_schema_version(conn) -> int:
+    """读取数据库当前的结构版本"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cursor.fetchone()[0]
+
+
+def migrate(conn) -> List[int]:
+    """执行所有未应用的迁移，返回本次应用的版本号"""
+    applied = []
+    for version, description, step in MIGRATIONS:
+        if version <= get_schema_version(conn):
+            continue
+        
+        # BEGIN IMMEDIATE 拿到写锁，防止多个进程同时执行同一迁移
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= get_schema_version(conn):
+                conn.rollback()
+                continue
+            cursor = conn.cursor()
+            step(cursor)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+_migrated_paths = set()
+_migrate_lock = threading.Lock()
+
+
+def ensure_schema(db_path: str = DEFAULT_DB_PATH):
+    """确保数据库结构为最新版本，每个进程对每个数据库只检查一次"""
+    if db_path in _migrated_paths:
+        return
+    with _migrate_lock:
+        if db_path in _migrated_paths:
+            return
+        conn = get_connection(db_path)
+        try:
+            migrate(conn)
+        finally:
+            conn.close()
+        _migrated_paths.add(db_path)
+
+
+# ---------------------------------------------------------------------------
+# 标注写后队列（write-behind）
+# ---------------------------------------------------------------------------
+
+# 写锁等待超时时的最大重试次数（每次重试前连接本身还会等待 busy_timeout）
+WRITE_MAX_RETRIES = 5
+# 进程退出时等待写线程写完队列的最长时间（秒）
+WRITE_CLOSE_TIMEOUT_SECONDS = 30
+
+
+def _is_busy_error(error: sqlite3.OperationalError) -> bool:
+    """是否为写锁冲突等可以重试的临时错误"""
+    code = getattr(error, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return 'locked' in str(error) or 'busy' in str(error)
+
+
+def dead_letter_path(db_path: str = DEFAULT_DB_PATH) -> str:
+    """写入失败的标注保存位置"""
+    return f"{db_path}.failed.jsonl"
+
+
+def replay_dead_letters(db_path: str = DEFAULT_DB_PATH) -> Tuple[int, int]:
+    """重新写入此前失败的标注，返回 (成功条数, 仍失败条数)
+
+    仍然失败的标注保留在文件中，全部成功后删除文件。
+    """
+    path = dead_letter_path(db_path)
+    if not os.path.exists(path):
+        return 0, 0
+    with open(path, 'r', encoding='utf-8') as f:
+        rows = [tuple(json.loads(line)['row']) for line in f if line.strip()]
+    
+    failed = []
+    conn = get_connection(db_path)
+    try:
+        for row in rows:
+            try:
+                conn.execute(UPSERT_ANNOTATION_SQL, row)
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                failed.append(row)
+    finally:
+        conn.close()
+    
+    if failed:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for row in failed:
+                f.write(json.dumps({'row': row}, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, path)
+    else:
+        os.remove(path)
+    return len(rows) - len(failed), len(failed)
+
+
+class AnnotationWriteQueue:
+    """标注异步写入队列
+
+    保存请求先放入进程内队列并立即返回，后台写线程每个刷写周期把队列中的
+    标注用 executemany 在一个事务中批量提交。队列已满时按 overflow 策略处理：
+    'sync' 直接同步写入，'block' 等待队列腾出空间。进程退出时会先写完队列。
+
+    只有写锁冲突会有限次重试；其他错误或重试耗尽时，标注追加到
+    dead_letter_path() 文件中，可用 reset_database.py --replay-failed 重新写入。
+    """
+
+    def __init__(self, db_path: str, flush_interval_ms: int = 200, max_batch: int = 500,
+                 max_pending: int = 10000, overflow: str = 'sync',
+                 max_retries: int = WRITE_MAX_RETRIES):
+        self.db_path = db_path
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+        self.overflow = overflow
+        self.max_retries = max_retries
+        self.failed_count = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        # 尚未写入数据库的标注，供界面立即显示保存状态
+        self._pending: Dict[Tuple, Tuple] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='annotation-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, row: Tuple):
+        """提交一条标注，row 与 UPSERT_ANNOTATION_SQL 的参数顺序一致"""
+        key = (row[1], row[4], row[2])
+        with self._lock:
+            self._pending[key] = row
+        try:
+            if self.overflow == 'block':
+                self._queue.put(row)
+            else:
+                self._queue.put_nowait(row)
+        except queue.Full:
+            # 队列溢出，退化为同步写入
+            self._write_batch([row])
+
+    def get_pending(self, task_id: str, annotator_id: str, data_index: int) -> Optional[Tuple]:
+        """返回尚未落库的标注行，没有则返回 None"""
+        with self._lock:
+            return self._pending.get((task_id, annotator_id, data_index))
+
+    def flush(self):
+        """阻塞直到当前队列中的标注全部写入"""
+        self._queue.join()
+
+    def close(self, timeout: float = WRITE_CLOSE_TIMEOUT_SECONDS):
+        """停止写线程，退出前写完队列中剩余的标注
+
+        超时仍未写完时，把队列中剩余的标注转存到失败文件，不阻塞进程退出。
+        """
+        self._stop.set()
+        self._thread.join(timeout)
+        if not self._thread.is_alive():
+            return
+        remaining = []
+        while True:
+            try:
+                remaining.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if remaining:
+            self._dead_letter(remaining, f"写线程 {timeout} 秒内未退出")
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            
+            # 等待一个刷写周期，让同一周期内的保存合并到一个事务中
+            self._stop.wait(self.flush_interval)
+            batch = [first]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            try:
+                self._write_batch(batch)
+            finally:
+                # 写线程异常退出时 flush() 也不会永久阻塞
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _dead_letter(self, rows: List[Tuple], reason: str):
+        """把写入失败的标注追加到失败文件，避免静默丢失"""
+        self.failed_count += len(rows)
+        path = dead_letter_path(self.db_path)
+        try:
+            with open(path, 'a', encoding='utf-8') as f:
+                for row in rows:
+                    f.write(json.dumps({'row': row, 'error': reason}, ensure_ascii=False) + '\n')
+            print(f"标注批量写入失败，{len(rows)} 条已转存到 {path}: {reason}", file=sys.stderr)
+        except OSError as e:
+            print(f"标注批量写入失败且无法转存，丢弃 {len(rows)} 条: {reason}; {e}", file=sys.stderr)
+
+    def _write_batch(self, rows: List[Tuple]):
+        attempt = 0
+        while True:
+            conn = None
+            try:
+                # 新建连接设置 PRAGMA 时也可能遇到写锁，同样按临时错误处理
+                conn = get_connection(self.db_path)
+                conn.executemany(UPSERT_ANNOTATION_SQL, rows)
+                conn.commit()
+                break
+            except sqlite3.OperationalError as e:
+                # 只有写锁冲突是临时错误，退避后有限次重试
+                if not _is_busy_error(e) or attempt >= self.max_retries:
+                    self._dead_letter(rows, str(e))
+                    break
+                attempt += 1
+                print(f"标注批量写入遇到写锁（第 {attempt} 次重试）: {e}", file=sys.stderr)
+                time.sleep(min(0.1 * attempt, 2))
+            except sqlite3.Error as e:
+                self._dead_letter(rows, str(e))
+                break
+            finally:
+                if conn is not None:
+                    conn.close()
+        
+        with self._lock:
+            for row in rows:
+                key = (row[1], row[4], row[2])
+                if self._pending.get(key) is row:
+                    del self._pending[key]
+
+
+_write_queues: Dict[str, AnnotationWriteQueue] = {}
+_write_queues_lock = threading.Lock()
+
+
+def get_write_queue(db_path: str = DEFAULT_DB_PATH, **options) -> AnnotationWriteQueue:
+    """获取指定数据库的进程级标注写后队列"""
+    with _write_queues_lock:
+        write_queue = _write_queues.get(db_path)
+        if write_queue is None:
+            write_queue = AnnotationWriteQueue(db_path, **options)
+            _write_queues[db_path] = write_queue
+        return write_queue
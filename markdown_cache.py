@@ -0,0 +1,289 @@
+"""
+Markdown 预渲染缓存
+把 Markdown 字段（含 LaTeX 公式）预先转换为清洗过的 HTML，按内容哈希缓存到磁盘，不依赖 Streamlit
+
+公式在 Markdown 转换前被提取出来，避免下划线、星号等被当作强调语法；
+安装了 latex2mathml 时公式转换为浏览器原生支持的 MathML。
+任一可选依赖缺失、或公式无法转换时返回 None，页面退回到 st.markdown 直接渲染原文。
+"""
+
+import os
+import re
+import html as html_lib
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import data_store
+
+# 可选依赖：Markdown 转换、HTML 清洗、LaTeX 转 MathML
+try:
+    import markdown
+except ImportError:
+    markdown = None
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+try:
+    from latex2mathml.converter import convert as latex_to_mathml
+except ImportError:
+    latex_to_mathml = None
+
+MARKDOWN_CACHE_DIR = os.path.join('data', 'cache', 'markdown')
+# 渲染规则变化时递增，旧缓存自然失效
+RENDER_VERSION = '2'
+MARKDOWN_EXTENSIONS = ['extra', 'sane_lists']
+# 进程内保留的渲染结果条数
+MEMORY_CACHE_ENTRIES = 512
+
+# 清洗后保留的标签及其属性
+ALLOWED_TAGS: Dict[str, List[str]] = {
+    'p': [], 'br': [], 'hr': [], 'h1': [], 'h2': [], 'h3': [], 'h4': [], 'h5': [], 'h6': [],
+    'strong': [], 'em': [], 'b': [], 'i': [], 'u': [], 's': [], 'del': [], 'sup': [], 'sub': [],
+    'code': ['class'], 'pre': [], 'blockquote': [], 'ul': [], 'ol': ['start'], 'li': [],
+    'dl': [], 'dt': [], 'dd': [], 'abbr': ['title'], 'span': [], 'div': [],
+    'a': ['href', 'title'], 'img': ['src', 'alt', 'title'],
+    'table': [], 'thead': [], 'tbody': [], 'tr': [], 'th': ['align', 'colspan', 'rowspan'],
+    'td': ['align', 'colspan', 'rowspan'],
+}
+# 公式转换结果同样经过清洗，只保留表现型 MathML 标签及其排版属性
+_MATHML_TOKEN_ATTRIBUTES = ['mathvariant', 'mathcolor', 'mathsize']
+ALLOWED_MATHML_TAGS: Dict[str, List[str]] = {
+    'math': ['xmlns', 'display'],
+    'mrow': [], 'mi': _MATHML_TOKEN_ATTRIBUTES, 'mn': _MATHML_TOKEN_ATTRIBUTES,
+    'mtext': _MATHML_TOKEN_ATTRIBUTES, 'ms': _MATHML_TOKEN_ATTRIBUTES,
+    'mo': _MATHML_TOKEN_ATTRIBUTES + ['accent', 'fence', 'form', 'largeop', 'lspace', 'rspace',
+                                      'maxsize', 'minsize', 'movablelimits', 'separator',
+                                      'stretchy', 'symmetric'],
+    'mspace': ['width', 'height', 'depth'],
+    'mfrac': ['linethickness'], 'msqrt': [], 'mroot': [],
+    'msub': [], 'msup': [], 'msubsup': [], 'munder': ['accentunder'], 'mover': ['accent'],
+    'munderover': ['accent', 'accentunder'], 'mmultiscripts': [], 'mprescripts': [], 'none': [],
+    'mstyle': ['displaystyle', 'scriptlevel', 'mathcolor', 'mathvariant'],
+    'mtable': ['columnalign', 'columnlines', 'columnspacing', 'rowalign', 'rowlines', 'rowspacing', 'frame'],
+    'mtr': ['columnalign', 'rowalign'], 'mtd': ['columnalign', 'rowalign', 'columnspan', 'rowspan'],
+    'menclose': ['notation'], 'mpadded': ['width', 'height', 'depth', 'lspace', 'voffset'],
+    'mphantom': [], 'mfenced': ['open', 'close', 'separators'], 'merror': [],
+}
+# 连同内容一起删除的标签
+DROPPED_TAGS = ['script', 'style', 'iframe', 'object', 'embed', 'form', 'input', 'button',
+                'textarea', 'select', 'link', 'meta', 'base', 'svg', 'annotation-xml']
+URL_ATTRIBUTES = ('href', 'src')
+ALLOWED_URL_SCHEMES = ('http', 'https', 'mailto')
+# 浏览器解析 URL 时会忽略控制字符和空白（如 java\tscript:），判断协议前先全部去掉
+_URL_IGNORED_CHARS = re.compile(r'[\x00-\x20\x7f-\x9f\s]+')
+_URL_SCHEME_PATTERN = re.compile(r'([a-zA-Z][a-zA-Z0-9+.-]*):')
+
+# 代码块和行内代码中的 $ 不是公式
+_CODE_PATTERN = re.compile(r'(```.*?```|~~~.*?~~~|`[^`\n]+`)', re.DOTALL)
+# 依次匹配 $$...$$、\[...\]、\(...\) 和行内 $...$（不以空格开头或结尾，避免把金额当作公式）
+_MATH_PATTERN = re.compile(
+    r'\$\$(?P<display>.+?)\$\$'
+    r'|\\\[(?P<display_bracket>.+?)\\\]'
+    r'|\\\((?P<inline_paren>.+?)\\\)'
+    r'|(?<![\\$])\$(?P<inline>[^\s$](?:[^$\n]*?[^\s\\$])?)\$(?!\d)',
+    re.DOTALL
+)
+# 公式占位符，每次渲染使用随机标记，原文中无法伪造
+_PLACEHOLDER = 'MATH{token}N{index}X'
+
+
+class _MathConversionError(Exception):
+    pass
+
+
+def _extract_math(text: str, token: str):
+    """把公式替换为占位符，返回 (替换后的文本, [(公式, 是否独立成行, 公式原文)])"""
+    formulas = []
+
+    def replace(match):
+        display = match.group('display') or match.group('display_bracket')
+        formula = display if display is not None else (match.group('inline_paren') or match.group('inline'))
+        formulas.append((formula.strip(), display is not None, match.group(0)))
+        return _PLACEHOLDER.format(token=token, index=len(formulas) - 1)
+
+    parts = _CODE_PATTERN.split(text)
+    for position in range(0, len(parts), 2):
+        parts[position] = _MATH_PATTERN.sub(replace, parts[position])
+    return ''.join(parts), formulas
+
+
+def _is_safe_url(value: str) -> bool:
+    """URL 是否为允许的协议或相对地址
+
+    先反转义并去掉浏览器会忽略的字符，再判断协议；第一个 /、?、# 之前出现冒号
+    但不是允许的协议时一律视为不安全。
+    """
+    normalized = _URL_IGNORED_CHARS.sub('', html_lib.unescape(str(value)))
+    scheme = _URL_SCHEME_PATTERN.match(normalized)
+    if scheme:
+        return scheme.group(1).lower() in ALLOWED_URL_SCHEMES
+    return ':' not in re.split(r'[/?#]', normalized, 1)[0]
+
+
+def _sanitize(soup) -> str:
+    """按白名单清洗 HTML：删除危险标签，展开未知标签，去掉不允许的属性和链接协议"""
+    for tag in soup.find_all(DROPPED_TAGS):
+        tag.decompose()
+    for tag in soup.find_all(True):
+        allowed_attributes = ALLOWED_TAGS.get(tag.name, ALLOWED_MATHML_TAGS.get(tag.name))
+        if allowed_attributes is None:
+            tag.unwrap()
+            continue
+        for attribute in list(tag.attrs):
+            value = tag.attrs[attribute]
+            if attribute not in allowed_attributes:
+                del tag.attrs[attribute]
+            elif attribute in URL_ATTRIBUTES and not _is_safe_url(value):
+                del tag.attrs[attribute]
+    return str(soup)
+
+
+def _restore_math(soup, formulas: List, token: str):
+    """把文本节点中的占位符替换为转换后的 MathML；属性值中的占位符还原为公式原文"""
+    pattern = re.compile(_PLACEHOLDER.format(token=re.escape(token), index=r'(\d+)'))
+
+    def formula_at(match) -> Tuple:
+        index = int(match.group(1))
+        if index >= len(formulas):
+            raise _MathConversionError(match.group(0))
+        return formulas[index]
+
+    for tag in soup.find_all(True):
+        for attribute, value in tag.attrs.items():
+            if isinstance(value, str) and token in value:
+                tag.attrs[attribute] = pattern.sub(lambda match: formula_at(match)[2], value)
+
+    for text_node in soup.find_all(string=pattern):
+        fragments = []
+        position = 0
+        for match in pattern.finditer(text_node):
+            formula, display, _ = formula_at(match)
+            try:
+                mathml = latex_to_mathml(formula, display='block' if display else 'inline')
+            except Exception as e:
+                raise _MathConversionError(formula) from e
+            fragments.append(text_node[position:match.start()])
+            fragments.extend(BeautifulSoup(mathml, 'html.parser').contents)
+            position = match.end()
+        fragments.append(text_node[position:])
+        for fragment in fragments:
+            text_node.insert_before(fragment)
+        text_node.extract()
+
+
+def _render(text: str) -> Tuple[Optional[str], bool]:
+    """返回 (HTML, 结果是否可以写入磁盘缓存)
+
+    缺少可选依赖导致的 None 不写入缓存，安装依赖后同一内容可以重新渲染。
+    """
+    if markdown is None or BeautifulSoup is None:
+        return None, False
+    token = secrets.token_hex(8)
+    source, formulas = _extract_math(text, token)
+    if formulas and latex_to_mathml is None:
+        return None, False
+    soup = BeautifulSoup(markdown.markdown(source, extensions=MARKDOWN_EXTENSIONS), 'html.parser')
+    try:
+        _restore_math(soup, formulas, token)
+    except _MathConversionError:
+        return None, True
+    # 转换器会原样输出 \text{} 中的内容，插入 MathML 之后再整体清洗
+    return _sanitize(soup), True
+
+
+def render_html(text: str) -> Optional[str]:
+    """把 Markdown 转换为清洗过的 HTML（不使用缓存），无法转换时返回 None"""
+    return _render(text)[0]
+
+
+# 进程内 LRU {content_hash: html 或 None}
+_memory_cache: OrderedDict = OrderedDict()
+_memory_cache_lock = threading.Lock()
+
+
+def _content_hash(text: str) -> str:
+    return hashlib.sha256(f"{RENDER_VERSION}\0{text}".encode('utf-8')).hexdigest()
+
+
+def get_html(text: str) -> Optional[str]:
+    """返回 Markdown 的预渲染 HTML，依次查找进程内缓存、磁盘缓存，缺失时渲染并写入缓存
+
+    返回 None 表示应由调用方直接渲染原文。
+    """
+    if markdown is None or BeautifulSoup is None:
+        return None
+    key = _content_hash(text)
+    with _memory_cache_lock:
+        if key in _memory_cache:
+            _memory_cache.move_to_end(key)
+            return _memory_cache[key]
+
+    # 磁盘缓存中空文件表示该内容的公式无法转换
+    cache_path = os.path.join(MARKDOWN_CACHE_DIR, key + '.html')
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            html = f.read() or None
+    except OSError:
+        html, cacheable = _render(text)
+        if cacheable:
+            try:
+                os.makedirs(MARKDOWN_CACHE_DIR, exist_ok=True)
+                tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(html or '')
+                os.replace(tmp_path, cache_path)
+            except OSError:
+                pass
+
+    with _memory_cache_lock:
+        _memory_cache[key] = html
+        while len(_memory_cache) > MEMORY_CACHE_ENTRIES:
+            _memory_cache.popitem(last=False)
+    return html
+
+
+# ---------------------------------------------------------------------------
+# 任务创建时后台预渲染
+# ---------------------------------------------------------------------------
+
+# 正在预渲染的数据文件，避免重复启动
+_warming: Dict[str, threading.Thread] = {}
+_warming_lock = threading.Lock()
+
+
+def _warm(data_path: str, fields: List[str]):
+    try:
+        with data_store.open_reader(data_path) as reader:
+            for item in reader.iter_range():
+                if not isinstance(item, dict):
+                    continue
+                for field in fields:
+                    value = item.get(field)
+                    if value is not None:
+                        get_html(str(value))
+    except Exception:
+        # 预渲染失败不影响任务，标注时会按需渲染
+        pass
+    finally:
+        with _warming_lock:
+            _warming.pop(data_path, None)
+
+
+def warm_markdown(data_path: str, fields: List[str]) -> bool:
+    """在后台线程中预渲染数据文件中所有 Markdown 字段，返回是否启动了新线程"""
+    if markdown is None or BeautifulSoup is None or not fields:
+        return False
+    with _warming_lock:
+        if data_path in _warming:
+            return False
+        thread = threading.Thread(target=_warm, args=(data_path, list(fields)),
+                                  name='markdown-warm', daemon=True)
+        _warming[data_path] = thread
+    thread.start()
+    return True
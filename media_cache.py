@@ -0,0 +1,252 @@
+"""
+媒体派生文件缓存
+为标注页面生成并缓存适合浏览器显示的图片缩略图和 PDF 页面预览，不依赖 Streamlit
+
+派生文件按源文件内容的 sha256 和目标尺寸命名，存放在 data/cache 下；
+源文件内容不变时，不同路径、不同任务引用的同一张图片共用一份缩略图。
+"""
+
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import data_store
+
+# 可选的图片处理库，未安装时直接显示原图
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+# 可选的 PDF 渲染库（PyMuPDF），未安装时 PDF 只提供下载
+try:
+    import pymupdf
+except ImportError:
+    try:
+        import fitz as pymupdf
+    except ImportError:
+        pymupdf = None
+
+THUMBNAIL_DIR = os.path.join('data', 'cache', 'thumbnails')
+# 标注页面显示图片的最大宽度（像素）
+THUMBNAIL_MAX_WIDTH = int(os.environ.get('THUMBNAIL_MAX_WIDTH', '1200'))
+THUMBNAIL_QUALITY = 82
+# 不超过该大小且尺寸已经合适的图片直接显示原图
+THUMBNAIL_MIN_SOURCE_BYTES = 200 * 1024
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tif', '.tiff')
+
+PDF_PREVIEW_DIR = os.path.join('data', 'cache', 'pdf_pages')
+# PDF 页面预览的渲染宽度（像素），以及标注页面每次显示的页数
+PDF_PREVIEW_WIDTH = int(os.environ.get('PDF_PREVIEW_WIDTH', '1000'))
+PDF_PREVIEW_PAGES = 3
+
+
+def _thumbnail_format() -> Tuple[str, str]:
+    """缩略图格式：Pillow 支持 WebP 时使用 WebP，否则使用 JPEG"""
+    if Image is not None and features.check('webp'):
+        return 'WEBP', '.webp'
+    return 'JPEG', '.jpg'
+
+
+# 进程内已计算的源文件哈希 {path: (signature, sha256)}
+_source_hashes: Dict[str, Tuple[Tuple[int, int], str]] = {}
+_source_hashes_lock = threading.Lock()
+
+
+def source_sha256(path: str) -> str:
+    """源文件内容的 sha256，文件未变化时复用上次的结果"""
+    signature = data_store.file_signature(path)
+    with _source_hashes_lock:
+        cached = _source_hashes.get(path)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    # data/math 等目录下的文件已按 sha256 命名，无需重新计算
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if len(stem) == data_store.SHA256_HEX_LENGTH and all(c in '0123456789abcdef' for c in stem):
+        sha256 = stem
+    else:
+        sha256 = data_store.hash_file(path)
+
+    with _source_hashes_lock:
+        _source_hashes[path] = (signature, sha256)
+    return sha256
+
+
+def thumbnail_path(source_path: str, max_width: int = THUMBNAIL_MAX_WIDTH) -> str:
+    """源文件对应的缩略图路径"""
+    _, suffix = _thumbnail_format()
+    return os.path.join(THUMBNAIL_DIR, f"{source_sha256(source_path)}_w{max_width}{suffix}")
+
+
+def get_thumbnail(source_path: str, max_width: int = THUMBNAIL_MAX_WIDTH) -> str:
+    """返回用于显示的图片路径，缩略图不存在时按需生成
+
+    Pillow 不可用、图片本身已经足够小或生成失败时返回原图路径。
+    """
+    if Image is None or not source_path.lower().endswith(IMAGE_EXTENSIONS):
+        return source_path
+    try:
+        target = thumbnail_path(source_path, max_width)
+        if os.path.exists(target):
+            return target
+
+        with Image.open(source_path) as image:
+            if (image.width <= max_width
+                    and os.path.getsize(source_path) <= THUMBNAIL_MIN_SOURCE_BYTES):
+                return source_path
+
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_width, max_width * 4))
+
+            image_format, _ = _thumbnail_format()
+            if image_format == 'JPEG' or image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if image_format == 'WEBP' and 'A' in image.getbands() else 'RGB')
+
+            # 先写临时文件再替换，并发生成同一张缩略图时不会读到半个文件
+            os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+            tmp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+            image.save(tmp_path, format=image_format, quality=THUMBNAIL_QUALITY)
+            os.replace(tmp_path, target)
+        return target
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return source_path
+
+
+# ---------------------------------------------------------------------------
+# PDF 页面预览
+# ---------------------------------------------------------------------------
+
+# 进程内已读取的 PDF 页数 {path: (signature, page_count)}
+_pdf_page_counts: Dict[str, Tuple[Tuple[int, int], int]] = {}
+
+
+def pdf_page_count(pdf_path: str) -> int:
+    """PDF 页数，PyMuPDF 不可用或文件无法解析时返回 0"""
+    if pymupdf is None:
+        return 0
+    signature = data_store.file_signature(pdf_path)
+    with _source_hashes_lock:
+        cached = _pdf_page_counts.get(pdf_path)
+    if cached and cached[0] == signature:
+        return cached[1]
+    try:
+        with pymupdf.open(pdf_path) as document:
+            page_count = document.page_count
+    except Exception:
+        page_count = 0
+    with _source_hashes_lock:
+        _pdf_page_counts[pdf_path] = (signature, page_count)
+    return page_count
+
+
+def pdf_page_preview_path(pdf_path: str, page_no: int, width: int = PDF_PREVIEW_WIDTH) -> str:
+    """PDF 第 page_no 页（从 0 开始）预览图的缓存路径"""
+    return os.path.join(PDF_PREVIEW_DIR, f"{source_sha256(pdf_path)}_p{page_no}_w{width}.png")
+
+
+def get_pdf_page_previews(pdf_path: str, start: int, end: int,
+                          width: int = PDF_PREVIEW_WIDTH) -> List[str]:
+    """返回 [start, end) 页的预览图路径，只渲染缓存中缺失的页面
+
+    PyMuPDF 不可用或渲染失败时返回空列表。
+    """
+    end = min(end, pdf_page_count(pdf_path))
+    if start >= end:
+        return []
+    targets = [pdf_page_preview_path(pdf_path, page_no, width) for page_no in range(start, end)]
+    missing = [page_no for page_no, target in zip(range(start, end), targets) if not os.path.exists(target)]
+    if not missing:
+        return targets
+
+    try:
+        os.makedirs(PDF_PREVIEW_DIR, exist_ok=True)
+        with pymupdf.open(pdf_path) as document:
+            for page_no in missing:
+                page = document[page_no]
+                zoom = width / page.rect.width if page.rect.width else 1
+                pixmap = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+                target = pdf_page_preview_path(pdf_path, page_no, width)
+                tmp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+                pixmap.save(tmp_path, output='png')
+                os.replace(tmp_path, target)
+    except Exception:
+        return []
+    return targets
+
+
+def display_path(full_path: str) -> Optional[str]:
+    """标注页面实际读取的文件：图片使用缩略图，PDF 使用首页预览
+
+    PDF 无法生成预览时返回 None（页面只提供下载，无需预取）。
+    """
+    if not os.path.exists(full_path):
+        return full_path
+    lower_path = full_path.lower()
+    if lower_path.endswith(IMAGE_EXTENSIONS):
+        return get_thumbnail(full_path)
+    if lower_path.endswith('.pdf'):
+        previews = get_pdf_page_previews(full_path, 0, 1)
+        return previews[0] if previews else None
+    return full_path
+
+
+# ---------------------------------------------------------------------------
+# 任务创建时后台预生成
+# ---------------------------------------------------------------------------
+
+# 正在预生成的数据文件，避免重复启动
+_warming: Dict[str, threading.Thread] = {}
+_warming_lock = threading.Lock()
+
+
+def _iter_referenced_files(data_path: str, fields: List[str], base_path: str,
+                            start: int = 0, end: int = None) -> Iterable[str]:
+    with data_store.open_reader(data_path) as reader:
+        for item in reader.iter_range(start, end):
+            if not isinstance(item, dict):
+                continue
+            for field in fields:
+                value = item.get(field)
+                if isinstance(value, str) and value:
+                    yield os.path.join(base_path, value) if base_path else value
+
+
+def _warm(data_path: str, fields: List[str], base_path: str, max_width: int):
+    try:
+        seen = set()
+        for full_path in _iter_referenced_files(data_path, fields, base_path):
+            if full_path in seen or not os.path.exists(full_path):
+                continue
+            seen.add(full_path)
+            if full_path.lower().endswith('.pdf'):
+                get_pdf_page_previews(full_path, 0, PDF_PREVIEW_PAGES)
+            else:
+                get_thumbnail(full_path, max_width)
+    except Exception:
+        # 预生成失败不影响任务，标注时会按需生成
+        pass
+    finally:
+        with _warming_lock:
+            _warming.pop(data_path, None)
+
+
+def warm_media_previews(data_path: str, fields: List[str], base_path: str = '',
+                        max_width: int = THUMBNAIL_MAX_WIDTH) -> bool:
+    """在后台线程中为数据文件引用的图片生成缩略图、为 PDF 渲染前几页预览
+
+    返回是否启动了新线程。
+    """
+    if (Image is None and pymupdf is None) or not fields:
+        return False
+    with _warming_lock:
+        if data_path in _warming:
+            return False
+        thread = threading.Thread(
+            target=_warm, args=(data_path, list(fields), base_path, max_width),
+            name='media-preview-warm', daemon=True
+        )
+        _warming[data_path] = thread
+    thread.start()
+    return True
@@ -0,0 +1,273 @@
+"""
+本地媒体文件服务
+在后台线程中运行一个只读 HTTP 服务，让浏览器直接按 URL 加载图片、PDF 及其预览，
+页面不再把文件内容嵌入 Streamlit 消息；支持 ETag、Range 请求和缓存头
+
+只允许访问显式登记的根目录（任务的 base_path 和派生文件缓存目录）下的文件；
+根目录标识由每个进程随机生成的密钥计算，无法由路径推算，包含应用目录、数据库
+或原始数据文件的目录不会被登记。通过环境变量 MEDIA_SERVER=1 启用，浏览器无法访问本机端口时可用
+MEDIA_SERVER_PUBLIC_URL 指定对外地址（如反向代理后的地址）。
+"""
+
+import os
+import sys
+import hmac
+import hashlib
+import secrets
+import mimetypes
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import quote, unquote
+
+import data_store
+
+MEDIA_SERVER_CONFIG = {
+    "enabled": os.environ.get('MEDIA_SERVER', '0') == '1',
+    "host": os.environ.get('MEDIA_SERVER_HOST', '127.0.0.1'),
+    "port": int(os.environ.get('MEDIA_SERVER_PORT', '8765')),
+    # 浏览器访问媒体服务的地址，为空时使用 http://localhost:<port>
+    "public_url": os.environ.get('MEDIA_SERVER_PUBLIC_URL', ''),
+}
+
+# 派生文件缓存目录下的文件按内容哈希命名，可以长期缓存
+IMMUTABLE_ROOTS = [os.path.join('data', 'cache')]
+CACHE_MAX_AGE_SECONDS = 3600
+IMMUTABLE_MAX_AGE_SECONDS = 365 * 24 * 3600
+COPY_CHUNK_SIZE = 256 * 1024
+
+# 不能被根目录包含的路径：应用代码和数据库所在目录、上传的原始数据文件
+PROTECTED_PATHS = [
+    os.path.dirname(os.path.abspath(__file__)),
+    os.getcwd(),
+    data_store.BLOB_DIR,
+    data_store.STAGING_DIR,
+]
+
+# 每个进程随机生成，URL 中的根目录标识只能通过本进程生成的链接得到
+_ROOT_ID_SECRET = secrets.token_bytes(32)
+
+# 已登记的根目录 {root_id: 绝对路径}
+_roots: Dict[str, str] = {}
+_roots_lock = threading.Lock()
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+
+def _root_id(root: str) -> str:
+    return hmac.new(_ROOT_ID_SECRET, root.encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+
+def _exposes_protected_path(root: str) -> bool:
+    """根目录是否包含应用目录、数据库或原始数据文件"""
+    for path in PROTECTED_PATHS:
+        protected = os.path.realpath(path)
+        if os.path.commonpath([root, protected]) == root:
+            return True
+    return False
+
+
+def allow_root(root: str) -> Optional[str]:
+    """登记允许访问的根目录，返回其在 URL 中使用的标识
+
+    根目录包含受保护路径（如任务 base_path 为 . 或 data）时拒绝登记，返回 None。
+    """
+    root = os.path.realpath(root)
+    if _exposes_protected_path(root):
+        return None
+    root_id = _root_id(root)
+    with _roots_lock:
+        _roots[root_id] = root
+    return root_id
+
+
+def _resolve(root_id: str, relative_path: str) -> Optional[Tuple[str, bool]]:
+    """把 URL 中的根目录标识和相对路径解析为文件路径，越出根目录时返回 None
+
+    返回 (文件路径, 是否可长期缓存)。
+    """
+    with _roots_lock:
+        root = _roots.get(root_id)
+    if root is None:
+        return None
+    full_path = os.path.realpath(os.path.join(root, relative_path))
+    if os.path.commonpath([root, full_path]) != root or not os.path.isfile(full_path):
+        return None
+    immutable = any(root == os.path.realpath(path) for path in IMMUTABLE_ROOTS)
+    return full_path, immutable
+
+
+class MediaRequestHandler(BaseHTTPRequestHandler):
+    """只读的文件请求处理，URL 形如 /r/<root_id>/<相对路径>"""
+
+    server_version = 'AnnotationMedia/1.0'
+
+    def log_message(self, format, *args):
+        # 不把每个请求打印到 Streamlit 控制台
+        pass
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body: bool):
+        parts = self.path.split('?', 1)[0].split('/', 3)
+        if len(parts) != 4 or parts[1] != 'r':
+            self.send_error(404)
+            return
+        resolved = _resolve(parts[2], unquote(parts[3]))
+        if resolved is None:
+            self.send_error(404)
+            return
+        full_path, immutable = resolved
+
+        stat = os.stat(full_path)
+        etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+        last_modified = formatdate(stat.st_mtime, usegmt=True)
+        max_age = IMMUTABLE_MAX_AGE_SECONDS if immutable else CACHE_MAX_AGE_SECONDS
+        cache_control = f"public, max-age={max_age}" + (", immutable" if immutable else "")
+
+        if self._not_modified(etag, stat.st_mtime):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', cache_control)
+            self.end_headers()
+            return
+
+        start, end = 0, stat.st_size - 1
+        status = 200
+        range_header = self.headers.get('Range')
+        # If-Range 与当前版本不一致时忽略 Range，返回完整文件
+        if range_header and self.headers.get('If-Range', etag) == etag:
+            byte_range = self._parse_range(range_header, stat.st_size)
+            if byte_range is None:
+                self.send_response(416)
+                self.send_header('Content-Range', f"bytes */{stat.st_size}")
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            start, end = byte_range
+            status = 206
+
+        length = max(end - start + 1, 0)
+        self.send_response(status)
+        self.send_header('Content-Type', mimetypes.guess_type(full_path)[0] or 'application/octet-stream')
+        self.send_header('Content-Length', str(length))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+        self.send_header('Cache-Control', cache_control)
+        if status == 206:
+            self.send_header('Content-Range', f"bytes {start}-{end}/{stat.st_size}")
+        self.end_headers()
+
+        if not send_body or length == 0:
+            return
+        try:
+            with open(full_path, 'rb') as f:
+                f.seek(start)
+                remaining = length
+                while remaining > 0:
+                    chunk = f.read(min(COPY_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            # 浏览器取消请求（如拖动 PDF 进度）属于正常情况
+            pass
+
+    def _not_modified(self, etag: str, mtime: float) -> bool:
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    @staticmethod
+    def _parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+        """解析单个 bytes 范围，不满足时返回 None；多段范围只取第一段"""
+        if not range_header.startswith('bytes=') or size == 0:
+            return None
+        spec = range_header[len('bytes='):].split(',', 1)[0].strip()
+        first, _, last = spec.partition('-')
+        try:
+            if first == '':
+                # bytes=-N 表示最后 N 个字节
+                suffix_length = int(last)
+                if suffix_length <= 0:
+                    return None
+                return max(size - suffix_length, 0), size - 1
+            start = int(first)
+            end = int(last) if last else size - 1
+        except ValueError:
+            return None
+        if start >= size or end < start:
+            return None
+        return start, min(end, size - 1)
+
+
+def is_enabled() -> bool:
+    """媒体服务是否启用并已成功启动"""
+    return MEDIA_SERVER_CONFIG['enabled'] and ensure_started()
+
+
+def ensure_started() -> bool:
+    """在当前进程中启动媒体服务（只启动一次），端口被占用等失败时返回 False"""
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return True
+        if not MEDIA_SERVER_CONFIG['enabled']:
+            return False
+        try:
+            server = ThreadingHTTPServer((MEDIA_SERVER_CONFIG['host'], MEDIA_SERVER_CONFIG['port']),
+                                         MediaRequestHandler)
+        except OSError as e:
+            print(f"媒体服务启动失败，改为直接嵌入文件内容: {e}", file=sys.stderr)
+            MEDIA_SERVER_CONFIG['enabled'] = False
+            return False
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='media-server', daemon=True).start()
+        _server = server
+        for root in IMMUTABLE_ROOTS:
+            allow_root(root)
+        return True
+
+
+def base_url() -> str:
+    """浏览器访问媒体服务的地址"""
+    if MEDIA_SERVER_CONFIG['public_url']:
+        return MEDIA_SERVER_CONFIG['public_url'].rstrip('/')
+    port = _server.server_address[1] if _server is not None else MEDIA_SERVER_CONFIG['port']
+    return f"http://localhost:{port}"
+
+
+def url_for(full_path: str, base_path: str = '') -> Optional[str]:
+    """返回文件的访问 URL
+
+    文件必须位于任务的 base_path 或派生文件缓存目录下；媒体服务未启用、文件不在
+    允许的目录内或 base_path 包含受保护路径时返回 None，调用方应退回到直接嵌入文件内容。
+    """
+    if not is_enabled():
+        return None
+    real_path = os.path.realpath(full_path)
+    candidate_roots = list(IMMUTABLE_ROOTS) + ([base_path] if base_path else [])
+    for root in candidate_roots:
+        real_root = os.path.realpath(root)
+        if os.path.commonpath([real_root, real_path]) == real_root:
+            root_id = allow_root(real_root)
+            if root_id is None:
+                continue
+            relative_path = os.path.relpath(real_path, real_root).replace(os.sep, '/')
+            return f"{base_url()}/r/{root_id}/{quote(relative_path)}"
+    return None
@@ -2,19 +2,37 @@
 """
 数据库重置工具
 当遇到数据库结构不兼容的问题时，使用此脚本重建数据库
+
+其他维护命令:
+    python reset_database.py --verify-progress    校验进度计数表
+    python reset_database.py --rebuild-progress   从标注表重建进度计数表、已保存区间表和每日统计汇总表
+    python reset_database.py --gc-blobs           删除没有任务引用的数据文件
+    python reset_database.py --replay-failed      重新写入写后队列中写入失败的标注
 """
 
 import os
+import sys
 import sqlite3
-import shutil
 from datetime import datetime
 
+import db_utils
+
 def backup_database():
-    """备份现有数据库"""
+    """备份现有数据库
+
+    数据库使用 WAL 模式，尚未检查点的事务只在 -wal 文件中，
+    因此通过 SQLite 在线备份接口复制完整内容，而不是只复制 .db 文件。
+    """
     db_path = 'annotation_platform.db'
     if os.path.exists(db_path):
         backup_name = f'annotation_platform_backup_{datetime.now().strftime("%Y%m%d_%H%M%S")}.db'
-        shutil.copy2(db_path, backup_name)
+        source = sqlite3.connect(db_path)
+        target = sqlite3.connect(backup_name)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
         print(f"✅ 已备份数据库到: {backup_name}")
         return backup_name
     return None
@@ -26,74 +44,17 @@ def reset_database():
     # 备份现有数据库
     backup_file = backup_database()
     
-    # 删除现有数据库
+    # 删除现有数据库，连同 WAL 和共享内存文件，避免新数据库读到旧的 WAL
     if os.path.exists(db_path):
         os.remove(db_path)
         print("🗑️ 已删除旧数据库")
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
     
-    # 创建新数据库
+    # 创建新数据库（与应用共用同一套迁移步骤）
     conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    # 创建任务表
-    cursor.execute('''
-        CREATE TABLE tasks (
-            id TEXT PRIMARY KEY,
-            name TEXT NOT NULL,
-            description TEXT,
-            config TEXT,
-            status TEXT DEFAULT 'created',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            data_path TEXT
-        )
-    ''')
-    
-    # 创建标注表
-    cursor.execute('''
-        CREATE TABLE annotations (
-            id TEXT PRIMARY KEY,
-            task_id TEXT,
-            data_index INTEGER,
-            result TEXT,
-            status TEXT DEFAULT 'pending',
-            annotator_id TEXT DEFAULT 'user1',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (task_id) REFERENCES tasks (id)
-        )
-    ''')
-    
-    # 创建用户表
-    cursor.execute('''
-        CREATE TABLE users (
-            id TEXT PRIMARY KEY,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            email TEXT UNIQUE,
-            role TEXT DEFAULT 'annotator',
-            full_name TEXT,
-            is_active BOOLEAN DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_login TIMESTAMP
-        )
-    ''')
-    
-    # 创建任务分配表
-    cursor.execute('''
-        CREATE TABLE task_assignments (
-            id TEXT PRIMARY KEY,
-            task_id TEXT NOT NULL,
-            assigned_to TEXT NOT NULL,
-            assigned_by TEXT NOT NULL,
-            assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            status TEXT DEFAULT 'assigned',
-            FOREIGN KEY (task_id) REFERENCES tasks (id),
-            FOREIGN KEY (assigned_to) REFERENCES users (id),
-            FOREIGN KEY (assigned_by) REFERENCES users (id)
-        )
-    ''')
-    
-    conn.commit()
+    db_utils.migrate(conn)
     conn.close()
     
     print("✅ 新数据库创建完成")
@@ -105,7 +66,60 @@ def reset_database():
         print(f"   - 所有任务需要重新创建")
         print(f"   - 如需恢复旧数据，请将备份文件重命名为 annotation_platform.db")
 
+def rebuild_progress(verify_only: bool = False):
+    """校验并（可选）重建 task_progress 计数表和 annotator_daily_counts 汇总表"""
+    conn = sqlite3.connect(db_utils.DEFAULT_DB_PATH)
+    mismatches = db_utils.verify_task_progress(conn)
+    
+    if not mismatches:
+        print("✅ 进度计数与标注数据一致")
+    else:
+        print(f"⚠️ 发现 {len(mismatches)} 条不一致的进度计数:")
+        for item in mismatches[:20]:
+            print(f"   - 任务 {item['task_id']} / 标注者 {item['annotator_id']}: "
+                  f"实际 {item['actual']}，记录 {item['recorded']}")
+        if len(mismatches) > 20:
+            print(f"   ... 还有 {len(mismatches) - 20} 条")
+    
+    if not verify_only:
+        db_utils.rebuild_task_progress(conn)
+        db_utils.rebuild_annotator_daily_counts(conn)
+        db_utils.rebuild_annotation_runs(conn)
+        conn.commit()
+        print("✅ 进度计数、已保存区间和每日统计汇总已重建")
+    
+    conn.close()
+
+def gc_blobs():
+    """重算数据文件引用计数，并删除没有任务引用的数据文件"""
+    conn = sqlite3.connect(db_utils.DEFAULT_DB_PATH)
+    db_utils.migrate(conn)
+    db_utils.rebuild_data_blob_refs(conn)
+    conn.commit()
+    removed, freed = db_utils.collect_unreferenced_blobs(conn)
+    conn.close()
+    print(f"✅ 已删除 {removed} 个未被引用的数据文件，释放 {freed / 1024 / 1024:.1f} MB")
+
+def replay_failed_annotations():
+    """重新写入写后队列转存的失败标注"""
+    written, failed = db_utils.replay_dead_letters(db_utils.DEFAULT_DB_PATH)
+    print(f"✅ 已重新写入 {written} 条标注")
+    if failed:
+        print(f"⚠️ 仍有 {failed} 条写入失败，保留在 {db_utils.dead_letter_path(db_utils.DEFAULT_DB_PATH)}")
+
 if __name__ == "__main__":
+    if "--verify-progress" in sys.argv or "--rebuild-progress" in sys.argv:
+        rebuild_progress(verify_only="--verify-progress" in sys.argv)
+        sys.exit(0)
+    
+    if "--gc-blobs" in sys.argv:
+        gc_blobs()
+        sys.exit(0)
+    
+    if "--replay-failed" in sys.argv:
+        replay_failed_annotations()
+        sys.exit(0)
+    
     print("🔧 数据库重置工具")
     print("=" * 50)
     
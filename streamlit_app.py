@@ -9,9 +9,9 @@ import json
 import base64
 from pathlib import Path
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timedelta
 import uuid
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple, Iterable
 import os
 import hashlib
 import hmac
@@ -21,6 +21,12 @@ import time
 import re
 from dataclasses import dataclass
 
+import db_utils
+import data_store
+import media_cache
+import media_server
+import markdown_cache
+
 # 页面配置
 st.set_page_config(
     page_title="数据标注平台",
@@ -41,6 +47,15 @@ AI_CONFIG = {
     "temperature": 0.7
 }
 
+# 标注写后队列配置（设置环境变量 ANNOTATION_WRITE_BEHIND=1 启用）
+WRITE_BEHIND_CONFIG = {
+    "enabled": os.environ.get("ANNOTATION_WRITE_BEHIND", "0") == "1",
+    "flush_interval_ms": 200,   # 每个刷写周期合并提交一次
+    "max_batch": 500,           # 单个事务最多写入的标注数
+    "max_pending": 10000,       # 队列容量
+    "overflow": "sync"          # 队列满时: sync 同步写入 / block 等待
+}
+
 @dataclass
 class AgentMessage:
     """Agent 消息类"""
@@ -477,9 +492,9 @@ def get_current_context() -> Dict:
         context["current_task_id"] = st.session_state['selected_task_id']
     
     # 添加当前数据信息
-    if 'upload_data' in st.session_state:
-        context["data_count"] = len(st.session_state['upload_data'])
-        context["data_sample"] = st.session_state['upload_data'][:2] if st.session_state['upload_data'] else []
+    if 'upload_staging_path' in st.session_state:
+        context["data_count"] = st.session_state.get('upload_count', 0)
+        context["data_sample"] = st.session_state.get('upload_sample', [])[:2]
     
     return context
 
@@ -666,149 +681,113 @@ def logout():
 
 # 数据库初始化
 def init_database():
-    """初始化SQLite数据库"""
-    conn = sqlite3.connect('annotation_platform.db')
-    cursor = conn.cursor()
-    
-    # 创建任务表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tasks (
-            id TEXT PRIMARY KEY,
-            name TEXT NOT NULL,
-            description TEXT,
-            config TEXT,
-            status TEXT DEFAULT 'created',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            data_path TEXT,
-            task_label TEXT,
-            parent_task_id TEXT,
-            split_index INTEGER DEFAULT 0,
-            total_splits INTEGER DEFAULT 1
-        )
-    ''')
-    
-    # 创建标注表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS annotations (
-            id TEXT PRIMARY KEY,
-            task_id TEXT,
-            data_index INTEGER,
-            result TEXT,
-            status TEXT DEFAULT 'pending',
-            annotator_id TEXT DEFAULT 'user1',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (task_id) REFERENCES tasks (id)
-        )
-    ''')
-    
-    # 检查并添加tasks表的新列
-    try:
-        cursor.execute("SELECT task_label FROM tasks LIMIT 1")
-    except sqlite3.OperationalError:
-        cursor.execute("ALTER TABLE tasks ADD COLUMN task_label TEXT")
-    
-    try:
-        cursor.execute("SELECT parent_task_id FROM tasks LIMIT 1")
-    except sqlite3.OperationalError:
-        cursor.execute("ALTER TABLE tasks ADD COLUMN parent_task_id TEXT")
-    
-    try:
-        cursor.execute("SELECT split_index FROM tasks LIMIT 1")
-    except sqlite3.OperationalError:
-        cursor.execute("ALTER TABLE tasks ADD COLUMN split_index INTEGER DEFAULT 0")
-    
-    try:
-        cursor.execute("SELECT total_splits FROM tasks LIMIT 1")
-    except sqlite3.OperationalError:
-        cursor.execute("ALTER TABLE tasks ADD COLUMN total_splits INTEGER DEFAULT 1")
+    """初始化SQLite数据库（迁移在每个服务进程中只执行一次）"""
+    db_utils.ensure_schema()
+
+# 标注完成情况
+class CompletionRanges:
+    """某个标注者在某个任务上已保存索引的游程区间视图
+
+    区间保存在 annotation_runs 表中，由触发器随标注的保存和删除维护；
+    这里不加载区间列表，每次查询只在主键上定位一次，与数据总量和已保存条数无关。
+    """
     
-    # 创建用户表 - 先检查是否已存在
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
-    users_table_exists = cursor.fetchone() is not None
+    def __init__(self, db_path: str, task_id: str, annotator_id: str, total: int, completed: int):
+        self.db_path = db_path
+        self.task_id = task_id
+        self.annotator_id = annotator_id
+        self.total = total
+        self.unsaved_count = max(total - completed, 0)
     
-    if not users_table_exists:
-        # 创建新的用户表
+    def _run_end_at(self, cursor, index: int) -> Optional[int]:
+        """包含 index 的区间终点，index 未保存时返回 None"""
         cursor.execute('''
-            CREATE TABLE users (
-                id TEXT PRIMARY KEY,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                email TEXT UNIQUE,
-                role TEXT DEFAULT 'annotator',
-                full_name TEXT,
-                is_active BOOLEAN DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_login TIMESTAMP
-            )
-        ''')
-    else:
-        # 检查并添加缺失的列
-        try:
-            cursor.execute("SELECT full_name FROM users LIMIT 1")
-        except sqlite3.OperationalError:
-            # full_name 列不存在，添加它
-            cursor.execute("ALTER TABLE users ADD COLUMN full_name TEXT")
-        
-        try:
-            cursor.execute("SELECT password_hash FROM users LIMIT 1")
-        except sqlite3.OperationalError:
-            # password_hash 列不存在，添加它
-            cursor.execute("ALTER TABLE users ADD COLUMN password_hash TEXT")
-        
-        try:
-            cursor.execute("SELECT email FROM users LIMIT 1")
-        except sqlite3.OperationalError:
-            # email 列不存在，添加它
-            cursor.execute("ALTER TABLE users ADD COLUMN email TEXT")
-        
+            SELECT run_end FROM annotation_runs
+            WHERE task_id = ? AND annotator_id = ? AND run_start <= ?
+            ORDER BY run_start DESC LIMIT 1
+        ''', (self.task_id, self.annotator_id, index))
+        row = cursor.fetchone()
+        return row[0] if row and row[0] > index else None
+    
+    def _first_unsaved_from(self, cursor, index: int) -> Optional[int]:
+        # 区间互不相邻，区间终点一定是未保存的索引
+        run_end = self._run_end_at(cursor, index)
+        if run_end is not None:
+            index = run_end
+        return index if index < self.total else None
+    
+    def is_saved(self, index: int) -> bool:
+        """指定索引是否已保存"""
+        conn = db_utils.get_connection(self.db_path)
         try:
-            cursor.execute("SELECT is_active FROM users LIMIT 1")
-        except sqlite3.OperationalError:
-            # is_active 列不存在，添加它
-            cursor.execute("ALTER TABLE users ADD COLUMN is_active BOOLEAN DEFAULT 1")
-        
+            return self._run_end_at(conn.cursor(), index) is not None
+        finally:
+            conn.close()
+    
+    def next_unsaved(self, after: int, wrap: bool = True) -> Optional[int]:
+        """返回 after 之后的第一个未保存索引，wrap 时找不到则从头查找"""
+        conn = db_utils.get_connection(self.db_path)
         try:
-            cursor.execute("SELECT last_login FROM users LIMIT 1")
-        except sqlite3.OperationalError:
-            # last_login 列不存在，添加它
-            cursor.execute("ALTER TABLE users ADD COLUMN last_login TIMESTAMP")
-    
-    # 创建任务分配表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS task_assignments (
-            id TEXT PRIMARY KEY,
-            task_id TEXT NOT NULL,
-            assigned_to TEXT NOT NULL,
-            assigned_by TEXT NOT NULL,
-            assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            status TEXT DEFAULT 'assigned',
-            FOREIGN KEY (task_id) REFERENCES tasks (id),
-            FOREIGN KEY (assigned_to) REFERENCES users (id),
-            FOREIGN KEY (assigned_by) REFERENCES users (id)
-        )
-    ''')
+            cursor = conn.cursor()
+            result = self._first_unsaved_from(cursor, after + 1)
+            if result is None and wrap:
+                result = self._first_unsaved_from(cursor, 0)
+            return result
+        finally:
+            conn.close()
     
-    conn.commit()
-    conn.close()
+    def first_unsaved(self, k: int) -> List[int]:
+        """返回最前面的 k 个未保存索引"""
+        result = []
+        conn = db_utils.get_connection(self.db_path)
+        try:
+            cursor = conn.cursor()
+            index = self._first_unsaved_from(cursor, 0)
+            while index is not None and len(result) < k:
+                result.append(index)
+                index = self._first_unsaved_from(cursor, index + 1)
+        finally:
+            conn.close()
+        return result
 
 # 数据库操作类
 class DatabaseManager:
-    def __init__(self, db_path='annotation_platform.db'):
+    def __init__(self, db_path=db_utils.DEFAULT_DB_PATH):
         self.db_path = db_path
+        self.write_queue = None
+        if WRITE_BEHIND_CONFIG["enabled"]:
+            options = {k: v for k, v in WRITE_BEHIND_CONFIG.items() if k != "enabled"}
+            self.write_queue = db_utils.get_write_queue(db_path, **options)
     
     def get_connection(self):
-        return sqlite3.connect(self.db_path)
+        """从进程级连接池获取连接，close() 时归还连接池"""
+        return db_utils.get_connection(self.db_path)
     
     def create_task(self, task_data: Dict) -> str:
         """创建标注任务"""
         task_id = str(uuid.uuid4())
+        
+        # 创建任务时生成行偏移索引，标注页面据此按行随机读取
+        item_count = task_data.get('item_count')
+        data_path = task_data.get('data_path', '')
+        if data_path and os.path.exists(data_path):
+            start, end = data_store.resolve_range(data_path, task_data.get('data_start', 0), task_data.get('data_end'))
+            if item_count is None:
+                item_count = end - start
+        elif item_count is None:
+            item_count = 0
+        
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        # 内容寻址的数据文件先登记，插入任务时由触发器增加引用计数
+        sha256 = data_store.blob_sha256(data_path)
+        if sha256 and os.path.exists(data_path):
+            cursor.execute(db_utils.REGISTER_BLOB_SQL, (sha256, data_path, os.path.getsize(data_path)))
+        
         cursor.execute('''
-            INSERT INTO tasks (id, name, description, config, data_path, task_label, parent_task_id, split_index, total_splits)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO tasks (id, name, description, config, data_path, task_label, parent_task_id, split_index, total_splits, item_count, data_start, data_end)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             task_id,
             task_data['name'],
@@ -818,13 +797,41 @@ class DatabaseManager:
             task_data.get('task_label', ''),
             task_data.get('parent_task_id', None),
             task_data.get('split_index', 0),
-            task_data.get('total_splits', 1)
+            task_data.get('total_splits', 1),
+            item_count,
+            task_data.get('data_start', 0),
+            task_data.get('data_end')
         ))
         
         conn.commit()
         conn.close()
         return task_id
     
+    def clone_task(self, task_id: str, name: str = None) -> Optional[str]:
+        """复制任务配置，新任务引用同一个数据文件和行范围，不复制数据"""
+        task = self.get_task(task_id)
+        if not task:
+            return None
+        
+        clone_data = {key: task[key] for key in [
+            'description', 'config', 'data_path', 'task_label',
+            'item_count', 'data_start', 'data_end'
+        ]}
+        clone_data['name'] = name or f"{task['name']} (副本)"
+        return self.create_task(clone_data)
+    
+    def find_data_blob(self, sha256: str) -> Optional[Dict]:
+        """按内容哈希查找已存在的数据文件，返回路径和引用它的任务数"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT path, size, ref_count FROM data_blobs WHERE sha256 = ?', (sha256,))
+        row = cursor.fetchone()
+        conn.close()
+        
+        if row and os.path.exists(row[0]):
+            return {'path': row[0], 'size': row[1], 'ref_count': row[2]}
+        return None
+    
     def get_task(self, task_id: str) -> Optional[Dict]:
         """获取任务信息"""
         conn = self.get_connection()
@@ -846,7 +853,10 @@ class DatabaseManager:
                 'task_label': row[7] if len(row) > 7 else None,
                 'parent_task_id': row[8] if len(row) > 8 else None,
                 'split_index': row[9] if len(row) > 9 else 0,
-                'total_splits': row[10] if len(row) > 10 else 1
+                'total_splits': row[10] if len(row) > 10 else 1,
+                'item_count': row[11] if len(row) > 11 else None,
+                'data_start': row[12] if len(row) > 12 and row[12] is not None else 0,
+                'data_end': row[13] if len(row) > 13 else None
             }
         return None
     
@@ -872,43 +882,39 @@ class DatabaseManager:
                 'task_label': row[7] if len(row) > 7 else None,
                 'parent_task_id': row[8] if len(row) > 8 else None,
                 'split_index': row[9] if len(row) > 9 else 0,
-                'total_splits': row[10] if len(row) > 10 else 1
+                'total_splits': row[10] if len(row) > 10 else 1,
+                'item_count': row[11] if len(row) > 11 else None,
+                'data_start': row[12] if len(row) > 12 and row[12] is not None else 0,
+                'data_end': row[13] if len(row) > 13 else None
             })
         return tasks
     
     def save_annotation(self, task_id: str, data_index: int, result: Any, annotator_id: str = 'user1'):
         """保存标注结果"""
-        annotation_id = str(uuid.uuid4())
+        row = (str(uuid.uuid4()), task_id, data_index, json.dumps(result), annotator_id)
+        
+        # 启用写后队列时由后台线程批量提交
+        if self.write_queue is not None:
+            self.write_queue.submit(row)
+            return
+        
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        # 检查是否已存在标注
-        cursor.execute('''
-            SELECT id FROM annotations 
-            WHERE task_id = ? AND data_index = ? AND annotator_id = ?
-        ''', (task_id, data_index, annotator_id))
-        
-        existing = cursor.fetchone()
-        
-        if existing:
-            # 更新现有标注
-            cursor.execute('''
-                UPDATE annotations 
-                SET result = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE task_id = ? AND data_index = ? AND annotator_id = ?
-            ''', (json.dumps(result), task_id, data_index, annotator_id))
-        else:
-            # 创建新标注
-            cursor.execute('''
-                INSERT INTO annotations (id, task_id, data_index, result, annotator_id)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (annotation_id, task_id, data_index, json.dumps(result), annotator_id))
+        # 一条 UPSERT 完成插入或更新，新插入的标注由触发器在同一事务中累加 task_progress 计数
+        cursor.execute(db_utils.UPSERT_ANNOTATION_SQL, row)
         
         conn.commit()
         conn.close()
     
     def get_annotation(self, task_id: str, data_index: int, annotator_id: str = 'user1') -> Optional[Dict]:
         """获取标注结果"""
+        # 写后队列中尚未落库的标注优先
+        if self.write_queue is not None:
+            pending = self.write_queue.get_pending(task_id, annotator_id, data_index)
+            if pending is not None:
+                return json.loads(pending[3])
+        
         conn = self.get_connection()
         cursor = conn.cursor()
         
@@ -926,46 +932,76 @@ class DatabaseManager:
     
     def get_task_progress(self, task_id: str, annotator_id: str = 'user1') -> Dict:
         """获取任务进度"""
+        return self.get_progress_for_tasks([task_id], annotator_id)[task_id]
+    
+    def get_progress_for_tasks(self, task_ids: List[str], annotator_id: str = 'user1') -> Dict[str, Dict]:
+        """批量获取多个任务的进度，返回 {task_id: 进度信息}"""
+        task_ids = list(dict.fromkeys(task_ids))
+        if not task_ids:
+            return {}
+        
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        # 获取总数据量
-        task = self.get_task(task_id)
-        if not task or not task.get('data_path'):
-            return {'total': 0, 'completed': 0, 'progress': 0, 'unsaved_indices': []}
-        
-        try:
-            with open(task['data_path'], 'r', encoding='utf-8') as f:
-                total = len(f.readlines())
-        except:
-            total = 0
-        
-        # 获取已完成数量和已保存的索引
-        cursor.execute('''
-            SELECT data_index FROM annotations 
-            WHERE task_id = ? AND annotator_id = ?
-        ''', (task_id, annotator_id))
-        
-        saved_indices = set(row[0] for row in cursor.fetchall())
-        completed = len(saved_indices)
+        item_counts = {}
+        completed_counts = {}
         
-        # 计算未保存的索引
-        all_indices = set(range(total))
-        unsaved_indices = sorted(list(all_indices - saved_indices))
+        for batch in db_utils.chunked(task_ids):
+            placeholders = ','.join('?' * len(batch))
+            
+            # 任务数据条数（创建任务时写入，不读取数据文件）
+            cursor.execute(f'SELECT id, item_count FROM tasks WHERE id IN ({placeholders})', batch)
+            item_counts.update(cursor.fetchall())
+            
+            # 已完成数量（由 task_progress 计数表直接读取）
+            cursor.execute(f'''
+                SELECT task_id, completed FROM task_progress 
+                WHERE annotator_id = ? AND task_id IN ({placeholders})
+            ''', [annotator_id, *batch])
+            completed_counts.update(cursor.fetchall())
         
         conn.close()
         
-        progress = (completed / total * 100) if total > 0 else 0
+        progress_map = {}
+        for task_id in task_ids:
+            total = item_counts.get(task_id) or 0
+            completed = completed_counts.get(task_id, 0)
+            # 未保存条目只在需要时按索引查询 annotation_runs
+            completion = CompletionRanges(self.db_path, task_id, annotator_id, total, completed)
+            
+            progress = (completed / total * 100) if total > 0 else 0
+            
+            progress_map[task_id] = {
+                'total': total,
+                'completed': completed,
+                'progress': round(progress, 2),
+                'unsaved_count': completion.unsaved_count,
+                'completion': completion
+            }
         
-        return {
-            'total': total,
-            'completed': completed,
-            'progress': round(progress, 2),
-            'unsaved_indices': unsaved_indices
-        }
+        return progress_map
+    
+    def rebuild_task_progress(self, verify_only: bool = False) -> List[Dict]:
+        """从标注表重新计算进度计数，返回重建前不一致的记录"""
+        conn = self.get_connection()
+        mismatches = db_utils.verify_task_progress(conn)
+        if mismatches and not verify_only:
+            db_utils.rebuild_task_progress(conn)
+            db_utils.rebuild_annotation_runs(conn)
+            conn.commit()
+        conn.close()
+        return mismatches
+    
+    def is_annotation_pending(self, task_id: str, data_index: int, annotator_id: str = 'user1') -> bool:
+        """检查指定数据的标注是否还在写后队列中等待写入"""
+        return (self.write_queue is not None
+                and self.write_queue.get_pending(task_id, annotator_id, data_index) is not None)
     
     def is_annotation_saved(self, task_id: str, data_index: int, annotator_id: str = 'user1') -> bool:
         """检查指定数据是否已保存标注"""
+        if self.is_annotation_pending(task_id, data_index, annotator_id):
+            return True
+        
         conn = self.get_connection()
         cursor = conn.cursor()
         
@@ -1124,33 +1160,45 @@ class DatabaseManager:
     
     def get_task_assignment(self, task_id: str) -> Optional[Dict]:
         """获取任务分配信息"""
+        return self.get_task_assignments([task_id]).get(task_id)
+    
+    def get_task_assignments(self, task_ids: List[str]) -> Dict[str, Dict]:
+        """批量获取任务分配信息，返回 {task_id: 分配信息}，未分配的任务不在结果中"""
+        task_ids = list(dict.fromkeys(task_ids))
+        if not task_ids:
+            return {}
+        
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT ta.assigned_to, ta.assigned_by, ta.assigned_at, 
-                   u1.username as assigned_to_username, u1.full_name as assigned_to_name,
-                   u2.username as assigned_by_username, u2.full_name as assigned_by_name
-            FROM task_assignments ta
-            JOIN users u1 ON ta.assigned_to = u1.id
-            JOIN users u2 ON ta.assigned_by = u2.id
-            WHERE ta.task_id = ?
-        ''', (task_id,))
+        rows = []
+        for batch in db_utils.chunked(task_ids):
+            placeholders = ','.join('?' * len(batch))
+            cursor.execute(f'''
+                SELECT ta.task_id, ta.assigned_to, ta.assigned_by, ta.assigned_at, 
+                       u1.username as assigned_to_username, u1.full_name as assigned_to_name,
+                       u2.username as assigned_by_username, u2.full_name as assigned_by_name
+                FROM task_assignments ta
+                JOIN users u1 ON ta.assigned_to = u1.id
+                JOIN users u2 ON ta.assigned_by = u2.id
+                WHERE ta.task_id IN ({placeholders})
+            ''', batch)
+            rows.extend(cursor.fetchall())
         
-        row = cursor.fetchone()
         conn.close()
         
-        if row:
-            return {
-                'assigned_to': row[0],
-                'assigned_by': row[1],
-                'assigned_at': row[2],
-                'assigned_to_username': row[3],
-                'assigned_to_name': row[4],
-                'assigned_by_username': row[5],
-                'assigned_by_name': row[6]
+        assignments = {}
+        for row in rows:
+            assignments[row[0]] = {
+                'assigned_to': row[1],
+                'assigned_by': row[2],
+                'assigned_at': row[3],
+                'assigned_to_username': row[4],
+                'assigned_to_name': row[5],
+                'assigned_by_username': row[6],
+                'assigned_by_name': row[7]
             }
-        return None
+        return assignments
     
     def get_user_assigned_tasks(self, user_id: str) -> List[Dict]:
         """获取分配给用户的任务"""
@@ -1186,7 +1234,7 @@ class DatabaseManager:
         cursor = conn.cursor()
         
         cursor.execute('''
-            SELECT COUNT(*) FROM annotations 
+            SELECT COALESCE(SUM(annotation_count), 0) FROM annotator_daily_counts 
             WHERE annotator_id = ?
         ''', (user_id,))
         
@@ -1194,147 +1242,184 @@ class DatabaseManager:
         conn.close()
         return count
     
-    def get_user_annotation_stats(self, user_id: str) -> Dict:
-        """获取用户标注详细统计"""
+    def get_user_annotation_stats(self, user_id: str, start_date: str = None, end_date: str = None) -> Dict:
+        """获取用户标注详细统计
+
+        基于每日汇总表的一次索引查询得到总数、按任务统计和按日统计；
+        start_date / end_date（YYYY-MM-DD，含端点）可限定统计范围。
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        # 总标注数
         cursor.execute('''
-            SELECT COUNT(*) FROM annotations 
-            WHERE annotator_id = ?
-        ''', (user_id,))
-        total_count = cursor.fetchone()[0]
+            SELECT r.day, r.task_id, t.name, r.annotation_count
+            FROM annotator_daily_counts r
+            LEFT JOIN tasks t ON r.task_id = t.id
+            WHERE r.annotator_id = ?
+              AND (? IS NULL OR r.day >= ?)
+              AND (? IS NULL OR r.day <= ?)
+        ''', (user_id, start_date, start_date, end_date, end_date))
+        rows = cursor.fetchall()
+        conn.close()
         
-        # 按任务分组的标注数
-        cursor.execute('''
-            SELECT t.name, COUNT(a.id) as count
-            FROM annotations a
-            JOIN tasks t ON a.task_id = t.id
-            WHERE a.annotator_id = ?
-            GROUP BY a.task_id, t.name
-            ORDER BY count DESC
-        ''', (user_id,))
-        task_stats = cursor.fetchall()
+        # 最近7天（与 date('now', '-7 days') 一致，按 UTC 计算）
+        recent_start = (datetime.utcnow().date() - timedelta(days=7)).isoformat()
         
-        # 最近7天的标注数
-        cursor.execute('''
-            SELECT DATE(created_at) as date, COUNT(*) as count
-            FROM annotations 
-            WHERE annotator_id = ? AND created_at >= date('now', '-7 days')
-            GROUP BY DATE(created_at)
-            ORDER BY date DESC
-        ''', (user_id,))
-        recent_stats = cursor.fetchall()
+        total_count = 0
+        task_counts = {}
+        daily_counts = {}
+        for day, task_id, task_name, count in rows:
+            total_count += count
+            if task_name is not None:
+                task_key = (task_id, task_name)
+                task_counts[task_key] = task_counts.get(task_key, 0) + count
+            daily_counts[day] = daily_counts.get(day, 0) + count
         
-        conn.close()
+        task_stats = sorted(task_counts.items(), key=lambda item: item[1], reverse=True)
+        daily_stats = sorted(daily_counts.items(), reverse=True)
         
         return {
             'total_count': total_count,
-            'task_stats': [{'task_name': row[0], 'count': row[1]} for row in task_stats],
-            'recent_stats': [{'date': row[0], 'count': row[1]} for row in recent_stats]
+            'task_stats': [{'task_name': key[1], 'count': count} for key, count in task_stats],
+            'daily_stats': [{'date': day, 'count': count} for day, count in daily_stats],
+            'recent_stats': [{'date': day, 'count': count} for day, count in daily_stats if day and day >= recent_start]
         }
     
-    def get_annotator_leaderboard(self, limit: int = 10) -> List[Dict]:
-        """获取标注者排行榜"""
+    @staticmethod
+    def _leaderboard_start_day(period: str) -> Optional[str]:
+        """排行榜统计窗口的起始日期（UTC，与 CURRENT_TIMESTAMP 一致），总榜返回 None"""
+        today = datetime.utcnow().date()
+        if period == 'week':
+            return (today - timedelta(days=today.weekday())).isoformat()
+        if period == 'month':
+            return today.replace(day=1).isoformat()
+        return None
+    
+    def _query_leaderboard(self, period: str, limit: int = None, user_id: str = None) -> List[Dict]:
+        """基于每日汇总表计算排名"""
+        start_day = self._leaderboard_start_day(period)
         conn = self.get_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
-            SELECT u.username, u.full_name, COUNT(a.id) as annotation_count,
-                   MIN(a.created_at) as first_annotation,
-                   MAX(a.created_at) as last_annotation
-            FROM users u
-            LEFT JOIN annotations a ON u.id = a.annotator_id
-            WHERE u.role = 'annotator'
-            GROUP BY u.id, u.username, u.full_name
-            HAVING annotation_count > 0
-            ORDER BY annotation_count DESC
+            SELECT * FROM (
+                SELECT u.id, u.username, u.full_name, t.annotation_count,
+                       t.first_annotation, t.last_annotation,
+                       ROW_NUMBER() OVER (ORDER BY t.annotation_count DESC, u.username) AS rank
+                FROM (
+                    SELECT annotator_id, SUM(annotation_count) AS annotation_count,
+                           MIN(first_annotation) AS first_annotation,
+                           MAX(last_annotation) AS last_annotation
+                    FROM annotator_daily_counts
+                    WHERE ? IS NULL OR day >= ?
+                    GROUP BY annotator_id
+                ) t
+                JOIN users u ON u.id = t.annotator_id
+                WHERE u.role = 'annotator' AND t.annotation_count > 0
+            )
+            WHERE ? IS NULL OR id = ?
+            ORDER BY rank
             LIMIT ?
-        ''', (limit,))
+        ''', (start_day, start_day, user_id, user_id, limit if limit is not None else -1))
         
         rows = cursor.fetchall()
         conn.close()
         
-        leaderboard = []
-        for i, row in enumerate(rows, 1):
-            leaderboard.append({
-                'rank': i,
-                'username': row[0],
-                'full_name': row[1],
-                'annotation_count': row[2],
-                'first_annotation': row[3],
-                'last_annotation': row[4]
-            })
-        
-        return leaderboard
-    
-    def create_split_tasks(self, original_task_data: Dict, data: List[Dict], num_splits: int) -> List[str]:
-        """将任务拆分成多个子任务"""
+        return [{
+            'rank': row[6],
+            'user_id': row[0],
+            'username': row[1],
+            'full_name': row[2],
+            'annotation_count': row[3],
+            'first_annotation': row[4],
+            'last_annotation': row[5]
+        } for row in rows]
+    
+    def get_annotator_leaderboard(self, limit: int = 10, period: str = 'all') -> List[Dict]:
+        """获取标注者排行榜，period 可选 'all' / 'week' / 'month'"""
+        return self._query_leaderboard(period, limit=limit)
+    
+    def get_annotator_rank(self, user_id: str, period: str = 'all') -> Optional[Dict]:
+        """获取任意标注者在排行榜中的排名，没有标注时返回 None"""
+        rows = self._query_leaderboard(period, user_id=user_id)
+        return rows[0] if rows else None
+    
+    def create_split_tasks(self, original_task_data: Dict, data_path: str, num_splits: int,
+                           bounds: List[Tuple[int, int]] = None) -> List[str]:
+        """将任务拆分成多个子任务
+
+        子任务共享同一个数据文件，各自只记录 [data_start, data_end) 行范围，不复制数据。
+        bounds 为各子任务的行范围（如按内容长度均衡的结果），为空时按条数均分。
+        """
         if num_splits <= 1:
             # 不拆分，直接创建原任务
             return [self.create_task(original_task_data)]
         
-        total_items = len(data)
-        base_size = total_items // num_splits
-        remainder = total_items % num_splits
+        if bounds is None:
+            bounds = data_store.even_split_bounds(data_store.get_item_count(data_path), num_splits)
+        num_splits = len(bounds)
         
         split_task_ids = []
-        start_index = 0
         
         # 为拆分任务生成一个共同的父任务ID
         parent_id = str(uuid.uuid4()) if num_splits > 1 else None
         
-        for split_idx in range(num_splits):
-            # 计算当前拆分的大小
-            current_size = base_size + (1 if split_idx < remainder else 0)
-            end_index = start_index + current_size
-            
-            # 获取当前拆分的数据
-            split_data = data[start_index:end_index]
-            
-            # 创建拆分任务的数据文件
-            split_filename = f"split_{split_idx + 1}_of_{num_splits}_{original_task_data['name']}.jsonl"
-            split_filepath = f"data/splits/{split_filename}"
-            
-            # 确保目录存在
-            os.makedirs(os.path.dirname(split_filepath), exist_ok=True)
-            
-            # 保存拆分的数据
-            FileProcessor.save_jsonl(split_data, split_filepath)
-            
+        for split_idx, (start_index, end_index) in enumerate(bounds):
             # 创建拆分任务的元数据
             split_task_data = original_task_data.copy()
             split_task_data['name'] = f"{original_task_data['name']} (第{split_idx + 1}部分)"
             split_task_data['description'] = f"{original_task_data.get('description', '')} - 拆分任务 {split_idx + 1}/{num_splits}"
-            split_task_data['data_path'] = split_filepath
+            split_task_data['data_path'] = data_path
+            split_task_data['data_start'] = start_index
+            split_task_data['data_end'] = end_index
             split_task_data['split_index'] = split_idx
             split_task_data['total_splits'] = num_splits
             split_task_data['parent_task_id'] = parent_id
+            split_task_data['item_count'] = end_index - start_index
             
             # 创建拆分任务
             task_id = self.create_task(split_task_data)
             split_task_ids.append(task_id)
-            
-            start_index = end_index
         
         return split_task_ids
 
 # 文件处理类
 class FileProcessor:
     @staticmethod
-    def load_jsonl(file_content: str) -> List[Dict]:
-        """加载JSONL文件"""
-        lines = file_content.strip().split('\n')
-        data = []
-        for i, line in enumerate(lines):
-            if line.strip():
-                try:
-                    data.append(json.loads(line))
-                except json.JSONDecodeError as e:
-                    st.error(f"第 {i+1} 行JSON格式错误: {e}")
-                    return []
-        return data
+    def stage_upload(uploaded_file, progress_callback=None) -> Optional[Dict[str, Any]]:
+        """把上传的JSONL流式写入暂存文件并校验
+
+        小文件边写边逐行校验；大文件先写入暂存文件，再按行分块用多进程并行解析。
+        返回 {'staging_path', 'count', 'sample', 'sha256'}；文件有格式错误时提示错误行并返回 None
+        """
+        staging_path = data_store.new_staging_path()
+        total_size = getattr(uploaded_file, 'size', None)
+        parallel = bool(total_size and total_size >= data_store.PARALLEL_PARSE_MIN_BYTES)
+        result = data_store.stage_jsonl_upload(
+            uploaded_file, staging_path,
+            total_size=total_size,
+            progress_callback=progress_callback,
+            validate=not parallel
+        )
+        if parallel:
+            sha256 = result['sha256']
+            result = data_store.parse_jsonl_parallel(staging_path, progress_callback=progress_callback)
+            result['sha256'] = sha256
+        if result['error'] is not None:
+            os.remove(staging_path)
+            st.error(f"第 {result['error']['line']} 行JSON格式错误: {result['error']['message']}")
+            return None
+        return {'staging_path': staging_path, 'count': result['count'], 'sample': result['sample'],
+                'sha256': result['sha256']}
+    
+    @staticmethod
+    def open_jsonl(file_path: str):
+        """打开JSONL文件，支持按索引和索引范围读取
+
+        未压缩文件以内存映射方式零拷贝读取，分帧压缩文件（.jsonl.gz / .jsonl.zst）只解压所需的帧。
+        用法: with FileProcessor.open_jsonl(path) as reader: item = reader[i]
+        """
+        return data_store.open_reader(file_path)
     
     @staticmethod
     def save_jsonl(data: List[Dict], file_path: str):
@@ -1344,7 +1429,7 @@ class FileProcessor:
                 f.write(json.dumps(item, ensure_ascii=False) + '\n')
     
     @staticmethod
-    def validate_file_paths(data: List[Dict], base_path: str = '') -> Dict[str, List[str]]:
+    def validate_file_paths(data: Iterable[Dict], base_path: str = '') -> Dict[str, List[str]]:
         """验证文件路径"""
         issues = {'missing': [], 'invalid': []}
         
@@ -1359,18 +1444,97 @@ class FileProcessor:
         
         return issues
 
+def _prefetch_media_resolver(full_path: str) -> Optional[str]:
+    """预取时先生成派生文件；通过媒体服务提供文件时由浏览器自行缓存，不再读入内存"""
+    display_path = media_cache.display_path(full_path)
+    return None if media_server.is_enabled() else display_path
+
+def get_session_prefetcher() -> data_store.SessionPrefetcher:
+    """获取当前会话的后台预取器"""
+    if 'prefetcher' not in st.session_state:
+        st.session_state['prefetcher'] = data_store.SessionPrefetcher(media_resolver=_prefetch_media_resolver)
+    return st.session_state['prefetcher']
+
 # 数据渲染器
 class DataRenderer:
+    # 文本/代码字段默认最多先显示的字符数（字段配置中 max_chars 为 0 表示不限制）
+    DEFAULT_TEXT_LIMIT = 3000
+    DEFAULT_CODE_LIMIT = 6000
+    # 超过该长度的内容不提供“全部展开”，改为下载完整内容
+    FULL_EXPAND_MAX_CHARS = 200000
+    
     @staticmethod
-    def render_text(data: str, field_name: str):
-        """渲染文本数据"""
-        st.text_area(f"📄 {field_name}", data, height=100, disabled=True)
+    def _text_window(data: str, field_name: str, max_chars: Optional[int], key: Optional[str],
+                     align_lines: bool = False) -> Tuple[str, Optional[str]]:
+        """计算当前显示窗口内的文本，并显示内容大小提示
+
+        返回 (窗口内文本, 窗口状态键)；内容未超过上限时状态键为 None。
+        """
+        total = len(data)
+        if not max_chars or total <= max_chars:
+            return data, None
+        
+        state_key = f"render_window_{key or f'{field_name}_{total}'}"
+        shown = st.session_state.get(state_key, max_chars)
+        window = data[:shown]
+        # 代码尽量按整行截断，避免显示半行；换行位于新增部分的前半段时
+        # （如遇到超长的行）保持按字符截断，保证每次展开窗口都会增长
+        if align_lines and shown < total:
+            previous_end = max(shown - max_chars, 0)
+            cut = window.rfind('\n')
+            if cut >= previous_end + max_chars // 2:
+                window = window[:cut + 1]
+        
+        if len(window) < total:
+            st.caption(f"📏 显示前 {len(window):,} / {total:,} 字符 · 共 {data.count(chr(10)) + 1:,} 行")
+        return window, state_key
     
     @staticmethod
-    def render_code(data: str, field_name: str, language: str = 'sql'):
-        """渲染代码数据"""
+    def _window_controls(data: str, field_name: str, window: str, state_key: Optional[str], max_chars: int):
+        """显示窗口展开按钮；内容过长时提供完整内容下载"""
+        if state_key is None or len(window) >= len(data):
+            return
+        col_more, col_all = st.columns(2)
+        with col_more:
+            if st.button(f"⬇️ 再显示 {max_chars:,} 字符", key=f"{state_key}_more"):
+                st.session_state[state_key] = len(window) + max_chars
+                st.rerun()
+        with col_all:
+            if len(data) <= DataRenderer.FULL_EXPAND_MAX_CHARS:
+                if st.button("📖 全部展开", key=f"{state_key}_all"):
+                    st.session_state[state_key] = len(data)
+                    st.rerun()
+            else:
+                st.download_button("📥 下载完整内容", data=data, file_name=f"{field_name}.txt",
+                                   key=f"{state_key}_download")
+    
+    @staticmethod
+    def _media_source(path: str, base_path: str = ''):
+        """图片的显示来源：媒体服务 URL，其次是预取的文件内容，最后是文件路径"""
+        url = media_server.url_for(path, base_path)
+        if url:
+            return url
+        cached = get_session_prefetcher().get_media(path)
+        return cached if cached is not None else path
+    
+    @staticmethod
+    def render_text(data: str, field_name: str, max_chars: Optional[int] = None, key: str = None):
+        """渲染文本数据，超长内容分段显示"""
+        max_chars = DataRenderer.DEFAULT_TEXT_LIMIT if max_chars is None else max_chars
+        window, state_key = DataRenderer._text_window(data, field_name, max_chars, key)
+        height = min(max(100, (window.count('\n') + len(window) // 80 + 1) * 24), 600)
+        st.text_area(f"📄 {field_name}", window, height=height, disabled=True)
+        DataRenderer._window_controls(data, field_name, window, state_key, max_chars)
+    
+    @staticmethod
+    def render_code(data: str, field_name: str, language: str = 'sql',
+                    max_chars: Optional[int] = None, key: str = None):
+        """渲染代码数据，超长代码按整行分段显示"""
         st.subheader(f"💻 {field_name}")
-        st.code(data, language=language)
+        max_chars = DataRenderer.DEFAULT_CODE_LIMIT if max_chars is None else max_chars
+        window, state_key = DataRenderer._text_window(data, field_name, max_chars, key, align_lines=True)
+        st.code(window, language=language)
+        DataRenderer._window_controls(data, field_name, window, state_key, max_chars)
     
     @staticmethod
     def render_image(file_path: str, field_name: str, base_path: str = ''):
@@ -1379,7 +1543,11 @@ class DataRenderer:
         full_path = os.path.join(base_path, file_path) if base_path else file_path
         
         if os.path.exists(full_path):
-            st.image(full_path, caption=file_path, use_column_width=True)
+            # 默认显示缓存的缩略图，需要时可切换为原图
+            show_original = st.checkbox("查看原图", key=f"original_{field_name}_{file_path}")
+            image_path = full_path if show_original else media_cache.get_thumbnail(full_path)
+            
+            st.image(DataRenderer._media_source(image_path, base_path), caption=file_path, use_column_width=True)
         else:
             st.error(f"图片文件不存在: {full_path}")
     
@@ -1392,23 +1560,58 @@ class DataRenderer:
         if os.path.exists(full_path):
             st.write(f"PDF文件: {file_path}")
             
-            # 提供下载链接
-            with open(full_path, "rb") as f:
-                bytes_data = f.read()
-                st.download_button(
-                    label="📥 下载PDF",
-                    data=bytes_data,
-                    file_name=os.path.basename(file_path),
-                    mime="application/pdf"
+            # 页面预览按需渲染并缓存，只处理当前显示的页码范围
+            page_count = media_cache.pdf_page_count(full_path)
+            if page_count:
+                first_page = 1
+                if page_count > media_cache.PDF_PREVIEW_PAGES:
+                    first_page = st.number_input(
+                        f"起始页（共 {page_count} 页）",
+                        min_value=1, max_value=page_count, value=1,
+                        key=f"pdf_page_{field_name}_{file_path}"
+                    )
+                previews = media_cache.get_pdf_page_previews(
+                    full_path, first_page - 1, first_page - 1 + media_cache.PDF_PREVIEW_PAGES
                 )
+                for page_no, preview in enumerate(previews, first_page):
+                    st.image(DataRenderer._media_source(preview, base_path),
+                             caption=f"第 {page_no}/{page_count} 页", use_column_width=True)
+            
+            # 通过媒体服务提供时浏览器可按 Range 分段加载，不经过 Streamlit
+            pdf_url = media_server.url_for(full_path, base_path)
+            if pdf_url:
+                st.link_button("📥 打开/下载PDF", pdf_url)
+            else:
+                # download_button 会把整个文件读入内存并登记到媒体管理器，
+                # 因此只在用户点击“准备下载”后才读取文件，下载完成后恢复
+                download_key = f"pdf_download_{field_name}_{file_path}"
+                if not st.session_state.get(download_key):
+                    if st.button("📥 准备下载PDF", key=f"{download_key}_prepare"):
+                        st.session_state[download_key] = True
+                        st.rerun()
+                else:
+                    with open(full_path, "rb") as f:
+                        pdf_bytes = f.read()
+                    st.download_button(
+                        label=f"📥 下载PDF（{len(pdf_bytes) / 1024 / 1024:.1f} MB）",
+                        data=pdf_bytes,
+                        file_name=os.path.basename(file_path),
+                        mime="application/pdf",
+                        key=f"{download_key}_button",
+                        on_click=lambda: st.session_state.pop(download_key, None)
+                    )
         else:
             st.error(f"PDF文件不存在: {full_path}")
     
     @staticmethod
     def render_markdown(data: str, field_name: str):
-        """渲染Markdown数据"""
+        """渲染Markdown数据，优先使用按内容哈希缓存的预渲染HTML"""
         st.subheader(f"📝 {field_name}")
-        st.markdown(data)
+        html = markdown_cache.get_html(data)
+        if html is not None:
+            st.markdown(html, unsafe_allow_html=True)
+        else:
+            st.markdown(data)
 
 # 标注表单生成器
 class AnnotationFormGenerator:
@@ -1572,6 +1775,11 @@ def task_assignment_page(db: DatabaseManager):
         st.warning("暂无标注者用户，请等待标注者注册")
         return
     
+    # 批量获取所有任务的进度和分配信息
+    task_ids = [task['id'] for task in tasks]
+    progress_map = db.get_progress_for_tasks(task_ids, st.session_state.user['id'])
+    assignment_map = db.get_task_assignments(task_ids)
+    
     # AI 智能分配建议
     st.subheader("🤖 AI 智能分配建议")
     
@@ -1587,7 +1795,7 @@ def task_assignment_page(db: DatabaseManager):
                     # 准备任务和标注者数据
                     task_data = []
                     for task in tasks:
-                        progress = db.get_task_progress(task['id'], st.session_state.user['id'])
+                        progress = progress_map[task['id']]
                         task_info = {
                             "id": task['id'][:8],
                             "name": task['name'],
@@ -1645,7 +1853,7 @@ def task_assignment_page(db: DatabaseManager):
         st.write(f"**任务描述**: {task['description']}")
         
         # 显示当前分配状态
-        current_assignment = db.get_task_assignment(task_id)
+        current_assignment = assignment_map.get(task_id)
         if current_assignment:
             st.info(f"📌 当前分配给: **{current_assignment['assigned_to_name']}** (@{current_assignment['assigned_to_username']})")
             st.write(f"分配时间: {current_assignment['assigned_at']}")
@@ -1682,8 +1890,8 @@ def task_assignment_page(db: DatabaseManager):
     st.subheader("📊 所有任务分配状态")
     
     for task in tasks:
-        assignment = db.get_task_assignment(task['id'])
-        progress = db.get_task_progress(task['id'], st.session_state.user['id'])
+        assignment = assignment_map.get(task['id'])
+        progress = progress_map[task['id']]
         
         # 构建任务标题
         title = f"📝 {task['name']}"
@@ -1730,8 +1938,10 @@ def annotator_home_page(db: DatabaseManager):
     
     st.write(f"您共有 **{len(assigned_tasks)}** 个分配的任务")
     
+    progress_map = db.get_progress_for_tasks([task['id'] for task in assigned_tasks], user_id)
+    
     for task in assigned_tasks:
-        progress = db.get_task_progress(task['id'], st.session_state.user['id'])
+        progress = progress_map[task['id']]
         
         with st.expander(f"📝 {task['name']} - {progress['progress']:.1f}% 完成"):
             col1, col2 = st.columns([3, 1])
@@ -1741,9 +1951,8 @@ def annotator_home_page(db: DatabaseManager):
                 st.write(f"**分配时间**: {task['assigned_at']}")
                 st.write(f"**标注进度**: {progress['completed']}/{progress['total']}")
                 
-                if progress['unsaved_indices']:
-                    unsaved_count = len(progress['unsaved_indices'])
-                    st.warning(f"⚠️ 还有 {unsaved_count} 条未保存")
+                if progress['unsaved_count']:
+                    st.warning(f"⚠️ 还有 {progress['unsaved_count']} 条未保存")
                 else:
                     st.success("✅ 所有条目已保存")
             
@@ -1773,8 +1982,10 @@ def annotator_progress_page(db: DatabaseManager):
     total_items = 0
     completed_items = 0
     
+    progress_map = db.get_progress_for_tasks([task['id'] for task in assigned_tasks], user_id)
+    
     for task in assigned_tasks:
-        progress = db.get_task_progress(task['id'], st.session_state.user['id'])
+        progress = progress_map[task['id']]
         total_items += progress['total']
         completed_items += progress['completed']
         if progress['progress'] >= 100:
@@ -1802,7 +2013,7 @@ def annotator_progress_page(db: DatabaseManager):
     st.subheader("📋 详细任务进度")
     
     for task in assigned_tasks:
-        progress = db.get_task_progress(task['id'], st.session_state.user['id'])
+        progress = progress_map[task['id']]
         
         with st.expander(f"📝 {task['name']} - {progress['progress']:.1f}% 完成"):
             st.write(f"**描述**: {task['description']}")
@@ -1812,10 +2023,10 @@ def annotator_progress_page(db: DatabaseManager):
                 st.progress(progress['progress'] / 100)
                 st.write(f"标注进度: {progress['completed']}/{progress['total']}")
                 
-                if progress['unsaved_indices']:
-                    unsaved_count = len(progress['unsaved_indices'])
+                if progress['unsaved_count']:
+                    unsaved_count = progress['unsaved_count']
                     if unsaved_count <= 5:
-                        unsaved_display = ', '.join([str(i+1) for i in progress['unsaved_indices']])
+                        unsaved_display = ', '.join([str(i+1) for i in progress['completion'].first_unsaved(5)])
                         st.warning(f"⚠️ 未保存: 第 {unsaved_display} 条")
                     else:
                         st.warning(f"⚠️ 还有 {unsaved_count} 条未保存")
@@ -1873,12 +2084,14 @@ def home_page(db: DatabaseManager):
     # 最近任务
     if tasks:
         st.subheader("📋 最近任务")
-        for task in tasks[:5]:
+        recent_tasks = tasks[:5]
+        progress_map = db.get_progress_for_tasks([task['id'] for task in recent_tasks], st.session_state.user['id'])
+        for task in recent_tasks:
             with st.expander(f"📝 {task['name']} ({task['status']})"):
                 st.write(f"**描述**: {task['description']}")
                 st.write(f"**创建时间**: {task['created_at']}")
                 
-                progress = db.get_task_progress(task['id'], st.session_state.user['id'])
+                progress = progress_map[task['id']]
                 if progress['total'] > 0:
                     st.progress(progress['progress'] / 100)
                     st.write(f"进度: {progress['completed']}/{progress['total']} ({progress['progress']:.1f}%)")
@@ -1921,23 +2134,53 @@ def upload_file_step(db: DatabaseManager):
     )
     
     if uploaded_file is not None:
-        # 读取文件内容
-        content = uploaded_file.read().decode('utf-8')
-        data = FileProcessor.load_jsonl(content)
-        
-        if data:
-            st.success(f"✅ 成功加载 {len(data)} 条数据")
+        # 同一个文件在页面重新运行时只暂存一次；file_id 每次上传都不同，
+        # 同名同大小的另一个文件也会重新暂存
+        upload_key = uploaded_file.file_id
+        staging_path = st.session_state.get('upload_staging_path')
+        if st.session_state.get('upload_key') != upload_key or not (staging_path and os.path.exists(staging_path)):
+            if staging_path and os.path.exists(staging_path):
+                os.remove(staging_path)
+            for key in ['upload_key', 'upload_staging_path', 'upload_count', 'upload_sample', 'upload_sha256',
+                        'upload_path_check_key', 'upload_missing_files']:
+                st.session_state.pop(key, None)
+            
+            progress_bar = st.progress(0.0, text="正在读取并校验文件...")
+            def report_progress(done: int, total: int):
+                progress_bar.progress(min(done / total, 1.0) if total else 1.0,
+                                      text=f"正在读取并校验文件... {done / 1024 / 1024:.1f} / {total / 1024 / 1024:.1f} MB")
+            
+            staged = FileProcessor.stage_upload(uploaded_file, progress_callback=report_progress)
+            progress_bar.empty()
+            if staged:
+                st.session_state['upload_key'] = upload_key
+                st.session_state['upload_staging_path'] = staged['staging_path']
+                st.session_state['upload_count'] = staged['count']
+                st.session_state['upload_sha256'] = staged['sha256']
+                st.session_state['upload_sample'] = staged['sample']
+        
+        staging_path = st.session_state.get('upload_staging_path')
+        data_count = st.session_state.get('upload_count', 0)
+        sample = st.session_state.get('upload_sample', [])
+        
+        if staging_path and data_count:
+            st.success(f"✅ 成功加载 {data_count} 条数据")
+            
+            # 相同内容之前上传过时复用已有数据文件，不会再占用磁盘
+            existing_blob = db.find_data_blob(st.session_state.get('upload_sha256', ''))
+            if existing_blob:
+                st.info(f"♻️ 该文件与已有数据内容相同（已被 {existing_blob['ref_count']} 个任务使用），创建任务时将直接复用")
             
             # 显示数据预览
             st.subheader("📋 数据预览")
             
             # 显示字段信息
-            if data:
-                fields = list(data[0].keys())
+            if sample:
+                fields = list(sample[0].keys())
                 st.write(f"**检测到的字段**: {', '.join(fields)}")
                 
                 # 显示前几条数据 - 转换为字符串避免类型冲突
-                preview_data = data[:5]
+                preview_data = sample[:5]
                 try:
                     # 将所有值转换为字符串以避免类型冲突
                     cleaned_data = []
@@ -1967,16 +2210,22 @@ def upload_file_step(db: DatabaseManager):
             )
             
             if base_path:
-                issues = FileProcessor.validate_file_paths(data, base_path)
-                if issues['missing']:
+                # 每个上传文件和基础路径只扫描一次，页面重新运行时直接使用保存的结果
+                path_check_key = (upload_key, base_path)
+                if st.session_state.get('upload_path_check_key') != path_check_key:
+                    with FileProcessor.open_jsonl(staging_path) as reader:
+                        missing = FileProcessor.validate_file_paths(reader.iter_range(), base_path)['missing']
+                    st.session_state['upload_path_check_key'] = path_check_key
+                    st.session_state['upload_missing_files'] = (missing[:10], len(missing))
+                missing_preview, missing_count = st.session_state['upload_missing_files']
+                if missing_count:
                     st.warning("⚠️ 发现缺失的文件:")
-                    for issue in issues['missing'][:10]:  # 只显示前10个
+                    for issue in missing_preview:  # 只显示前10个
                         st.write(f"- {issue}")
-                    if len(issues['missing']) > 10:
-                        st.write(f"... 还有 {len(issues['missing']) - 10} 个文件缺失")
+                    if missing_count > 10:
+                        st.write(f"... 还有 {missing_count - 10} 个文件缺失")
             
-            # 保存到session state
-            st.session_state['upload_data'] = data
+            # 保存到session state（只保存样例和暂存文件路径）
             st.session_state['upload_filename'] = uploaded_file.name
             st.session_state['base_path'] = base_path
             
@@ -1988,15 +2237,15 @@ def configure_fields_step(db: DatabaseManager):
     """字段配置步骤"""
     st.subheader("🏷️ 步骤2: 配置显示字段")
     
-    if 'upload_data' not in st.session_state:
+    if 'upload_staging_path' not in st.session_state:
         st.error("请先上传数据文件")
         if st.button("返回上传"):
             st.session_state['config_step'] = 0
             st.rerun()
         return
     
-    data = st.session_state['upload_data']
-    sample_data = data[0] if data else {}
+    sample = st.session_state.get('upload_sample', [])
+    sample_data = sample[0] if sample else {}
     
     st.write("请选择要在标注界面显示的字段，并配置每个字段的数据类型:")
     
@@ -2043,6 +2292,18 @@ def configure_fields_step(db: DatabaseManager):
                 field_configs[field] = {"type": field_type, "language": language}
             else:
                 field_configs[field] = {"type": field_type}
+            
+            # 长文本先显示前一部分，标注时可按需展开
+            if field_type in ("text", "code"):
+                default_limit = DataRenderer.DEFAULT_CODE_LIMIT if field_type == "code" else DataRenderer.DEFAULT_TEXT_LIMIT
+                field_configs[field]["max_chars"] = st.number_input(
+                    "初始显示字符数",
+                    min_value=0,
+                    value=default_limit,
+                    step=500,
+                    key=f"max_chars_{field}",
+                    help="超过该长度的内容分段显示，可在标注时继续展开；0 表示不限制"
+                )
     
     # 预览配置效果
     st.subheader("👀 配置预览")
@@ -2057,9 +2318,9 @@ def configure_fields_step(db: DatabaseManager):
                 value = preview_data[field]
                 
                 if config["type"] == "text":
-                    DataRenderer.render_text(str(value), field)
+                    DataRenderer.render_text(str(value), field, config.get("max_chars"))
                 elif config["type"] == "code":
-                    DataRenderer.render_code(str(value), field, config.get("language", "text"))
+                    DataRenderer.render_code(str(value), field, config.get("language", "text"), config.get("max_chars"))
                 elif config["type"] == "image":
                     DataRenderer.render_image(str(value), field, base_path)
                 elif config["type"] == "pdf":
@@ -2238,41 +2499,83 @@ def confirm_task_step(db: DatabaseManager):
     st.write("**任务拆分**:")
     col_split1, col_split2 = st.columns(2)
     
+    data_count = st.session_state.get('upload_count', 0)
     with col_split1:
-        enable_split = st.checkbox("启用任务拆分", help="将任务数据拆分成多个独立的子任务")
+        # 少于两条数据时无法拆分，避免产生没有数据的子任务
+        enable_split = st.checkbox(
+            "启用任务拆分",
+            disabled=data_count < 2,
+            help="将任务数据拆分成多个独立的子任务" if data_count >= 2 else "数据少于2条，无法拆分"
+        )
     
     with col_split2:
         num_splits = 1
-        if enable_split:
-            data_count = len(st.session_state.get('upload_data', []))
-            max_splits = min(data_count, 10)  # 最多拆分成10个子任务
+        split_bounds = None
+        if enable_split and data_count >= 2:
             num_splits = st.number_input(
                 "拆分数量", 
                 min_value=2, 
-                max_value=max_splits, 
+                max_value=data_count, 
                 value=2,
-                help=f"将 {data_count} 条数据拆分成几个子任务"
+                help=f"将 {data_count} 条数据拆分成几个子任务（每个子任务至少一条数据）"
+            )
+            split_modes = {'count': "按条数均分", 'chars': "按内容字符数均衡", 'tokens': "按内容词元数均衡"}
+            split_mode = st.radio(
+                "拆分方式",
+                options=list(split_modes.keys()),
+                format_func=lambda mode: split_modes[mode],
+                horizontal=True,
+                help="按内容均衡时统计所选显示字段的长度，使每个子任务的阅读量接近"
             )
             
+            # 计算拆分范围；按内容均衡只需扫描一遍暂存文件，结果在切换拆分数量时复用
+            if split_mode == 'count':
+                split_bounds = data_store.even_split_bounds(data_count, num_splits)
+                split_costs = None
+            else:
+                with st.spinner("正在统计数据内容长度..."):
+                    cost_prefix = data_store.item_cost_prefix(
+                        st.session_state['upload_staging_path'],
+                        st.session_state.get('selected_fields'),
+                        unit=split_mode
+                    )
+                split_bounds = data_store.balanced_split_bounds(cost_prefix, num_splits)
+                split_costs = [cost_prefix[end] - cost_prefix[start] for start, end in split_bounds]
+            
             # 显示拆分预览
             if num_splits > 1:
-                base_size = data_count // num_splits
-                remainder = data_count % num_splits
-                
                 st.write("**拆分预览**:")
-                for i in range(num_splits):
-                    size = base_size + (1 if i < remainder else 0)
-                    st.write(f"  • 第{i+1}部分: {size} 条数据")
+                preview = {
+                    "部分": [f"第{i+1}部分" for i in range(len(split_bounds))],
+                    "条数": [end - start for start, end in split_bounds],
+                }
+                if split_costs:
+                    preview["内容量"] = split_costs
+                st.dataframe(pd.DataFrame(preview), use_container_width=True, hide_index=True, height=min(36 * (len(split_bounds) + 1), 300))
+    
+    # 数据存储格式
+    compression_names = {'': "不压缩", 'gzip': "gzip 分帧压缩", 'zstd': "zstd 分帧压缩"}
+    compression_options = [''] + data_store.available_compressions()
+    default_compression = data_store.DEFAULT_COMPRESSION
+    compression = st.selectbox(
+        "数据存储格式",
+        options=compression_options,
+        index=compression_options.index(default_compression) if default_compression in compression_options else 0,
+        format_func=lambda option: compression_names[option],
+        help="压缩存储按帧独立压缩，标注时只解压所需的部分；相同内容已存在时沿用已有文件"
+    )
     
     # 存储新的配置到session state
     st.session_state['task_label'] = task_label
-    st.session_state['num_splits'] = num_splits if enable_split else 1
+    st.session_state['num_splits'] = len(split_bounds) if split_bounds else 1
+    st.session_state['split_bounds'] = split_bounds if enable_split else None
+    st.session_state['data_compression'] = compression
     
     # 配置摘要
     st.subheader("📋 配置摘要")
     
-    if 'upload_data' in st.session_state:
-        total_data = len(st.session_state['upload_data'])
+    if 'upload_staging_path' in st.session_state:
+        total_data = st.session_state.get('upload_count', 0)
         st.write(f"**数据量**: {total_data} 条")
         
         # 显示拆分信息
@@ -2325,30 +2628,38 @@ def confirm_task_step(db: DatabaseManager):
                         'selected_fields': st.session_state['selected_fields'],
                         'annotation_config': st.session_state['annotation_config'],
                         'base_path': st.session_state.get('base_path', ''),
-                        'total_items': len(st.session_state['upload_data'])
+                        'total_items': st.session_state['upload_count']
                     }
                 }
                 
-                upload_data = st.session_state['upload_data']
                 num_splits = st.session_state.get('num_splits', 1)
                 
+                # 暂存文件按内容哈希移动到 data/blobs，相同内容只保存一份
+                data_path = data_store.store_blob(
+                    st.session_state['upload_staging_path'],
+                    st.session_state.get('upload_sha256'),
+                    compression=st.session_state.get('data_compression') or None
+                )
+                
+                # 后台为图片字段预生成缩略图、为PDF字段渲染前几页预览，标注时不必等待
+                media_fields = [field for field in st.session_state['selected_fields']
+                                if st.session_state['field_configs'][field]['type'] in ('image', 'pdf')]
+                media_cache.warm_media_previews(data_path, media_fields, st.session_state.get('base_path', ''))
+                markdown_fields = [field for field in st.session_state['selected_fields']
+                                   if st.session_state['field_configs'][field]['type'] == 'markdown']
+                markdown_cache.warm_markdown(data_path, markdown_fields)
+                
                 if num_splits <= 1:
                     # 不拆分，创建单个任务
-                    data_filename = f"task_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
-                    data_path = os.path.join('data', data_filename)
-                    
-                    # 创建data目录
-                    os.makedirs('data', exist_ok=True)
-                    
-                    FileProcessor.save_jsonl(upload_data, data_path)
                     task_data['data_path'] = data_path
+                    task_data['item_count'] = st.session_state['upload_count']
                     
                     task_id = db.create_task(task_data)
                     st.success(f"✅ 任务创建成功！任务ID: {task_id}")
                     
                 else:
-                    # 使用拆分功能创建多个任务
-                    task_ids = db.create_split_tasks(task_data, upload_data, num_splits)
+                    # 使用拆分功能创建多个任务，各子任务只引用父数据文件中的行范围
+                    task_ids = db.create_split_tasks(task_data, data_path, num_splits, st.session_state.get('split_bounds'))
                     
                     st.success(f"✅ 任务拆分成功！创建了 {len(task_ids)} 个子任务")
                     
@@ -2360,7 +2671,7 @@ def confirm_task_step(db: DatabaseManager):
                     st.info(f"🔍 共拆分为 {num_splits} 个子任务，每个任务可以独立分配给不同的标注者")
                 
                 # 清理session state
-                for key in ['upload_data', 'field_configs', 'selected_fields', 'annotation_config', 'config_step', 'base_path', 'task_label', 'num_splits']:
+                for key in ['upload_key', 'upload_staging_path', 'upload_count', 'upload_sample', 'upload_sha256', 'upload_filename', 'upload_path_check_key', 'upload_missing_files', 'field_configs', 'selected_fields', 'annotation_config', 'config_step', 'base_path', 'task_label', 'num_splits', 'split_bounds', 'data_compression']:
                     if key in st.session_state:
                         del st.session_state[key]
                 
@@ -2418,15 +2729,15 @@ def annotation_page(db: DatabaseManager, annotator_view=False):
         st.error("任务不存在")
         return
     
-    # 加载任务数据
+    # 通过行偏移索引获取数据条数，只解析当前条目；拆分任务只看自己的行范围
     try:
-        with open(task['data_path'], 'r', encoding='utf-8') as f:
-            data = [json.loads(line) for line in f.readlines() if line.strip()]
+        data_start, data_end = data_store.resolve_range(task['data_path'], task['data_start'], task['data_end'])
+        total_items = data_end - data_start
     except Exception as e:
         st.error(f"加载任务数据失败: {e}")
         return
     
-    if not data:
+    if total_items == 0:
         st.error("任务数据为空")
         return
     
@@ -2434,12 +2745,12 @@ def annotation_page(db: DatabaseManager, annotator_view=False):
     if f'current_index_{task_id}' not in st.session_state:
         st.session_state[f'current_index_{task_id}'] = 0
     
-    current_index = st.session_state[f'current_index_{task_id}']
-    total_items = len(data)
+    current_index = min(st.session_state[f'current_index_{task_id}'], total_items - 1)
     
     # 进度显示
     progress = db.get_task_progress(task_id, st.session_state.user['id'])
-    is_current_saved = db.is_annotation_saved(task_id, current_index, st.session_state.user['id'])
+    is_current_saved = (progress['completion'].is_saved(current_index)
+                        or db.is_annotation_pending(task_id, current_index, st.session_state.user['id']))
     
     col1, col2, col3, col4 = st.columns(4)
     with col1:
@@ -2458,13 +2769,13 @@ def annotation_page(db: DatabaseManager, annotator_view=False):
     st.progress((current_index + 1) / total_items)
     
     # 显示未保存的条目提示
-    if progress['unsaved_indices']:
-        unsaved_count = len(progress['unsaved_indices'])
+    if progress['unsaved_count']:
+        unsaved_count = progress['unsaved_count']
         if unsaved_count <= 10:
-            unsaved_display = ', '.join([str(i+1) for i in progress['unsaved_indices']])
+            unsaved_display = ', '.join([str(i+1) for i in progress['completion'].first_unsaved(10)])
             st.info(f"📋 还有 {unsaved_count} 条未保存: 第 {unsaved_display} 条")
         else:
-            first_few = ', '.join([str(i+1) for i in progress['unsaved_indices'][:5]])
+            first_few = ', '.join([str(i+1) for i in progress['completion'].first_unsaved(5)])
             st.info(f"📋 还有 {unsaved_count} 条未保存: 第 {first_few} 条等...")
     
     # 任务说明
@@ -2474,12 +2785,24 @@ def annotation_page(db: DatabaseManager, annotator_view=False):
     
     st.divider()
     
-    # 显示当前数据
-    current_data = data[current_index]
+    # 显示当前数据，优先使用后台预取的结果
+    prefetcher = get_session_prefetcher()
+    try:
+        current_data = prefetcher.get_item(task['data_path'], data_start + current_index)
+        if current_data is None:
+            current_data = data_store.get_dataset_cache().get_item(task['data_path'], data_start + current_index)
+    except Exception as e:
+        st.error(f"加载第 {current_index + 1} 条数据失败: {e}")
+        return
     field_configs = task['config']['field_configs']
     selected_fields = task['config']['selected_fields']
     base_path = task['config'].get('base_path', '')
     
+    # 后台预取后续条目及其引用的图片/PDF
+    media_fields = [field for field in selected_fields
+                    if field_configs.get(field, {}).get('type') in ('image', 'pdf')]
+    prefetcher.schedule(task['data_path'], data_start + current_index + 1, data_end, media_fields, base_path)
+    
     # 数据展示区域
     st.subheader(f"📄 数据内容 ({current_index + 1}/{total_items})")
     
@@ -2488,10 +2811,13 @@ def annotation_page(db: DatabaseManager, annotator_view=False):
             config = field_configs[field]
             value = current_data[field]
             
+            # 显示窗口按任务、条目和字段区分，翻页后重新从头显示
+            window_key = f"{task_id}_{current_index}_{field}"
             if config["type"] == "text":
-                DataRenderer.render_text(str(value), field)
+                DataRenderer.render_text(str(value), field, config.get("max_chars"), key=window_key)
             elif config["type"] == "code":
-                DataRenderer.render_code(str(value), field, config.get("language", "text"))
+                DataRenderer.render_code(str(value), field, config.get("language", "text"),
+                                         config.get("max_chars"), key=window_key)
             elif config["type"] == "image":
                 DataRenderer.render_image(str(value), field, base_path)
             elif config["type"] == "pdf":
@@ -2520,7 +2846,7 @@ def annotation_page(db: DatabaseManager, annotator_view=False):
                     initialize_agents()
                     annotation_agent = st.session_state.agent_manager.get_agent("annotation")
                     
-                    suggestion = annotation_agent.suggest_annotation(current_item, annotation_config)
+                    suggestion = annotation_agent.suggest_annotation(current_data, annotation_config)
                     
                     st.success("✅ AI 建议已生成")
                     st.write("**AI 建议:**")
@@ -2549,7 +2875,7 @@ def annotation_page(db: DatabaseManager, annotator_view=False):
         # 翻译当前数据项
         translate_fields = st.multiselect(
             "选择要翻译的字段",
-            options=list(current_item.keys()),
+            options=list(current_data.keys()),
             key=f"translate_fields_{current_index}"
         )
         
@@ -2567,9 +2893,9 @@ def annotation_page(db: DatabaseManager, annotator_view=False):
                         translation_agent = st.session_state.agent_manager.get_agent("translation")
                         
                         for field in translate_fields:
-                            if field in current_item and current_item[field]:
+                            if field in current_data and current_data[field]:
                                 translated = translation_agent.translate_text(
-                                    str(current_item[field]), 
+                                    str(current_data[field]), 
                                     target_lang
                                 )
                                 st.write(f"**{field} ({target_lang}):**")
@@ -2678,17 +3004,9 @@ def annotation_page(db: DatabaseManager, annotator_view=False):
         
         with col4_2:
             # 跳转到下一个未保存的条目
-            if progress['unsaved_indices'] and st.button("📝 未保存", key=f"next_unsaved_{task_id}"):
-                # 找到当前位置之后的第一个未保存条目
-                next_unsaved = None
-                for idx in progress['unsaved_indices']:
-                    if idx > current_index:
-                        next_unsaved = idx
-                        break
-                
-                # 如果没有找到后面的，就跳转到第一个未保存的
-                if next_unsaved is None and progress['unsaved_indices']:
-                    next_unsaved = progress['unsaved_indices'][0]
+            if progress['unsaved_count'] and st.button("📝 未保存", key=f"next_unsaved_{task_id}"):
+                # 找到当前位置之后的第一个未保存条目，没有则回到第一个未保存的
+                next_unsaved = progress['completion'].next_unsaved(current_index)
                 
                 if next_unsaved is not None:
                     st.session_state[f'current_index_{task_id}'] = next_unsaved
@@ -2789,14 +3107,32 @@ def progress_page(db: DatabaseManager):
     with col3:
         st.metric("已完成", completed_tasks)
     
+    # 进程级数据缓存状态
+    with st.expander("🗄️ 数据缓存状态"):
+        cache_stats = data_store.get_dataset_cache().stats()
+        lookups = cache_stats['hits'] + cache_stats['misses']
+        hit_rate = cache_stats['hits'] / lookups * 100 if lookups else 0
+        
+        cache_col1, cache_col2, cache_col3 = st.columns(3)
+        with cache_col1:
+            st.metric("命中率", f"{hit_rate:.1f}%")
+        with cache_col2:
+            st.metric("命中/未命中", f"{cache_stats['hits']}/{cache_stats['misses']}")
+        with cache_col3:
+            st.metric("已用内存", f"{cache_stats['bytes'] / 1024 / 1024:.1f} / {cache_stats['max_bytes'] / 1024 / 1024:.0f} MB")
+    
     st.divider()
     
     # 任务详细进度
     st.subheader("📋 任务详细进度")
     
+    task_ids = [task['id'] for task in tasks]
+    progress_map = db.get_progress_for_tasks(task_ids, st.session_state.user['id'])
+    assignment_map = db.get_task_assignments(task_ids)
+    
     for task in tasks:
-        progress = db.get_task_progress(task['id'], st.session_state.user['id'])
-        assignment = db.get_task_assignment(task['id'])
+        progress = progress_map[task['id']]
+        assignment = assignment_map.get(task['id'])
         
         # 标题包含分配信息
         title = f"📝 {task['name']} - {progress['progress']:.1f}% 完成"
@@ -2823,10 +3159,10 @@ def progress_page(db: DatabaseManager):
                     st.write(f"标注进度: {progress['completed']}/{progress['total']}")
                     
                     # 显示未保存的条目
-                    if progress['unsaved_indices']:
-                        unsaved_count = len(progress['unsaved_indices'])
+                    if progress['unsaved_count']:
+                        unsaved_count = progress['unsaved_count']
                         if unsaved_count <= 5:
-                            unsaved_display = ', '.join([str(i+1) for i in progress['unsaved_indices']])
+                            unsaved_display = ', '.join([str(i+1) for i in progress['completion'].first_unsaved(5)])
                             st.warning(f"⚠️ 未保存: 第 {unsaved_display} 条")
                         else:
                             st.warning(f"⚠️ 还有 {unsaved_count} 条未保存")
@@ -2841,6 +3177,10 @@ def progress_page(db: DatabaseManager):
                     # 这里应该跳转到标注页面
                     st.success("已选择任务，请切换到标注页面")
                 
+                if st.button(f"📄 复制任务", key=f"clone_{task['id']}", help="新任务复用同一份数据文件，不复制数据"):
+                    clone_id = db.clone_task(task['id'])
+                    st.success(f"已复制任务，新任务ID: {clone_id}")
+                
                 if progress['completed'] > 0:
                     if st.button(f"📤 导出结果", key=f"export_{task['id']}"):
                         st.session_state['export_task_id'] = task['id']
@@ -2913,9 +3253,9 @@ def export_page(db: DatabaseManager):
     st.subheader("👀 数据预览")
     
     try:
-        # 加载原始数据
-        with open(task['data_path'], 'r', encoding='utf-8') as f:
-            original_data = [json.loads(line) for line in f.readlines() if line.strip()]
+        # 通过进程级数据缓存读取原始数据
+        data_start, data_end = data_store.resolve_range(task['data_path'], task['data_start'], task['data_end'])
+        original_data = data_store.get_dataset_cache().iter_items(task['data_path'], data_start, data_end)
         
         # 获取所有标注
         conn = db.get_connection()
@@ -3104,40 +3444,70 @@ def annotator_stats_page(db: DatabaseManager):
             st.write(f"• {item['date']}: {item['count']} 条标注")
     else:
         st.info("📅 最近7天没有标注活动")
+    
+    st.divider()
+    
+    # 自定义时间范围统计
+    st.subheader("🗓️ 自定义时间范围")
+    
+    today = datetime.utcnow().date()
+    date_range = st.date_input(
+        "选择日期范围",
+        value=(today - timedelta(days=29), today),
+        max_value=today
+    )
+    
+    if isinstance(date_range, (list, tuple)) and len(date_range) == 2:
+        range_start, range_end = date_range
+        range_stats = db.get_user_annotation_stats(user_id, range_start.isoformat(), range_end.isoformat())
+        
+        st.metric(f"{range_start} ~ {range_end} 标注数", range_stats['total_count'])
+        
+        if range_stats['daily_stats']:
+            chart_data = pd.DataFrame({
+                '日期': [item['date'] for item in range_stats['daily_stats']],
+                '标注数量': [item['count'] for item in range_stats['daily_stats']]
+            })
+            st.line_chart(chart_data.set_index('日期'))
+        else:
+            st.info("该时间范围内没有标注活动")
 
 def annotator_leaderboard_page(db: DatabaseManager):
     """标注者排行榜页面"""
     st.title("🏆 标注者排行榜")
     
+    # 排行榜统计窗口
+    period_names = {"all": "总榜", "week": "本周", "month": "本月"}
+    period = st.radio(
+        "统计周期",
+        options=list(period_names.keys()),
+        format_func=lambda x: period_names[x],
+        horizontal=True
+    )
+    
     # 获取排行榜数据
-    leaderboard = db.get_annotator_leaderboard(limit=10)
+    leaderboard = db.get_annotator_leaderboard(limit=10, period=period)
     
     if not leaderboard:
         st.info("🔍 暂无标注者数据，等待标注者开始工作...")
         return
     
-    st.subheader("🥇 Top 10 标注者")
-    st.write("根据总标注数量排名")
+    st.subheader(f"🥇 {period_names[period]} Top 10 标注者")
+    st.write("根据标注数量排名")
     
-    # 当前用户的信息
+    # 当前用户的排名（不在前10名时也能查到）
     current_user_id = st.session_state.user['id']
-    current_user_count = db.get_user_annotation_count(current_user_id)
-    current_user_rank = None
-    
-    # 查找当前用户排名
-    for item in leaderboard:
-        if item['username'] == st.session_state.user['username']:
-            current_user_rank = item['rank']
-            break
+    current_user_info = db.get_annotator_rank(current_user_id, period=period)
+    current_user_count = current_user_info['annotation_count'] if current_user_info else 0
+    current_user_rank = current_user_info['rank'] if current_user_info else None
     
     # 显示当前用户状态
-    if current_user_rank:
+    if current_user_rank and current_user_rank <= 10:
         st.success(f"🎉 您当前排名第 **{current_user_rank}** 位，共标注了 **{current_user_count}** 条数据！")
+    elif current_user_rank:
+        st.info(f"📊 您当前排名第 **{current_user_rank}** 位，已标注 **{current_user_count}** 条数据，继续加油进入前10！")
     else:
-        if current_user_count > 0:
-            st.info(f"📊 您已标注 **{current_user_count}** 条数据，继续加油进入前10！")
-        else:
-            st.info("🚀 开始您的第一个标注任务，冲击排行榜吧！")
+        st.info("🚀 开始您的第一个标注任务，冲击排行榜吧！")
     
     st.divider()
     
@@ -3185,7 +3555,7 @@ def annotator_leaderboard_page(db: DatabaseManager):
     if current_user_rank and current_user_rank <= 3:
         st.balloons()
         st.success("🎊 恭喜您位列前三名！您是优秀的标注者！")
-    elif current_user_rank:
+    elif current_user_rank and current_user_rank <= 10:
         st.info("💪 继续加油，您可以冲击更高的排名！")
     else:
         st.info("🎯 开始标注任务，您也可以登上排行榜！")
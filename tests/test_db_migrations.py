@@ -0,0 +1,154 @@
+"""
+数据库迁移及触发器维护的计数表的回归用例
+
+每个用例先执行全部迁移，再随机保存/删除标注，最后把触发器维护的
+task_progress、annotator_daily_counts、annotation_runs、data_blobs 与从原始表重新计算的结果比较。
+"""
+
+import os
+import random
+import shutil
+import sqlite3
+
+import pytest
+
+import db_utils
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUNDLED_DATABASES = ['annotation_platform.db', 'annotation_platform_backup_20250813_082500.db']
+LATEST_VERSION = db_utils.MIGRATIONS[-1][0]
+
+
+@pytest.fixture
+def empty_db(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'empty.db'))
+    yield conn
+    conn.close()
+
+
+@pytest.fixture(params=BUNDLED_DATABASES)
+def bundled_db(request, tmp_path):
+    path = tmp_path / request.param
+    shutil.copy(os.path.join(REPO_ROOT, request.param), path)
+    conn = sqlite3.connect(str(path))
+    yield conn
+    conn.close()
+
+
+def _daily_count_mismatches(conn):
+    return conn.execute('''
+        SELECT annotator_id, day, task_id, SUM(actual), SUM(recorded)
+        FROM (
+            SELECT annotator_id, DATE(created_at) AS day, task_id, COUNT(*) AS actual, 0 AS recorded
+            FROM annotations
+            GROUP BY annotator_id, DATE(created_at), task_id
+            UNION ALL
+            SELECT annotator_id, day, task_id, 0 AS actual, annotation_count AS recorded
+            FROM annotator_daily_counts
+        )
+        GROUP BY annotator_id, day, task_id
+        HAVING SUM(actual) != SUM(recorded)
+    ''').fetchall()
+
+
+def _runs(conn):
+    return conn.execute('''
+        SELECT task_id, annotator_id, run_start, run_end FROM annotation_runs
+        ORDER BY task_id, annotator_id, run_start
+    ''').fetchall()
+
+
+def _expected_runs(conn):
+    saved = {}
+    for task_id, annotator_id, data_index in conn.execute(
+            'SELECT task_id, annotator_id, data_index FROM annotations WHERE data_index IS NOT NULL'):
+        saved.setdefault((task_id, annotator_id), set()).add(data_index)
+    runs = []
+    for (task_id, annotator_id), indexes in sorted(saved.items()):
+        for index in sorted(indexes):
+            if runs and runs[-1][:2] == [task_id, annotator_id] and runs[-1][3] == index:
+                runs[-1][3] = index + 1
+            else:
+                runs.append([task_id, annotator_id, index, index + 1])
+    return [tuple(run) for run in runs]
+
+
+def _assert_counters_consistent(conn):
+    assert db_utils.verify_task_progress(conn) == []
+    assert _daily_count_mismatches(conn) == []
+    assert _runs(conn) == _expected_runs(conn)
+
+
+def _exercise_annotations(conn, steps=1500, seed=0):
+    """随机保存（含重复保存同一条）和删除标注，每个事务后检查计数"""
+    rng = random.Random(seed)
+    saved = set()
+    for step in range(steps):
+        key = (rng.choice(['t1', 't2']), rng.choice(['u1', 'u2']), rng.randrange(40))
+        if key in saved and rng.random() < 0.4:
+            conn.execute('DELETE FROM annotations WHERE task_id = ? AND annotator_id = ? AND data_index = ?', key)
+            saved.discard(key)
+        else:
+            task_id, annotator_id, data_index = key
+            conn.execute(db_utils.UPSERT_ANNOTATION_SQL,
+                         (f'a{step}', task_id, data_index, '{}', annotator_id))
+            saved.add(key)
+        conn.commit()
+        if step % 100 == 0:
+            _assert_counters_consistent(conn)
+    _assert_counters_consistent(conn)
+
+
+def test_migrate_empty_database(empty_db):
+    applied = db_utils.migrate(empty_db)
+    assert applied == [version for version, _, _ in db_utils.MIGRATIONS]
+    assert db_utils.get_schema_version(empty_db) == LATEST_VERSION
+    # 再次执行不会重复应用
+    assert db_utils.migrate(empty_db) == []
+    _exercise_annotations(empty_db)
+
+
+def test_migrate_bundled_database(bundled_db):
+    annotation_count = bundled_db.execute('SELECT COUNT(*) FROM annotations').fetchone()[0]
+    db_utils.migrate(bundled_db)
+    assert db_utils.get_schema_version(bundled_db) == LATEST_VERSION
+    # 已有标注在迁移时去重，计数表从现有数据回填
+    assert bundled_db.execute('SELECT COUNT(*) FROM annotations').fetchone()[0] <= annotation_count
+    _assert_counters_consistent(bundled_db)
+    _exercise_annotations(bundled_db, steps=500, seed=1)
+
+
+def test_rebuild_matches_trigger_maintained_tables(empty_db):
+    db_utils.migrate(empty_db)
+    _exercise_annotations(empty_db, steps=600, seed=2)
+    progress = empty_db.execute('SELECT task_id, annotator_id, completed FROM task_progress ORDER BY 1, 2').fetchall()
+    runs = _runs(empty_db)
+    db_utils.rebuild_task_progress(empty_db)
+    db_utils.rebuild_annotation_runs(empty_db)
+    db_utils.rebuild_annotator_daily_counts(empty_db)
+    empty_db.commit()
+    rebuilt = empty_db.execute(
+        'SELECT task_id, annotator_id, completed FROM task_progress WHERE completed > 0 ORDER BY 1, 2').fetchall()
+    assert rebuilt == [row for row in progress if row[2] > 0]
+    assert _runs(empty_db) == runs
+    _assert_counters_consistent(empty_db)
+
+
+def test_blob_ref_counts_follow_tasks(empty_db):
+    db_utils.migrate(empty_db)
+    empty_db.execute(db_utils.REGISTER_BLOB_SQL, ('a' * 64, 'data/blobs/a.jsonl', 10))
+    empty_db.execute(db_utils.REGISTER_BLOB_SQL, ('b' * 64, 'data/blobs/b.jsonl', 10))
+    for task_id, data_path in [('t1', 'data/blobs/a.jsonl'), ('t2', 'data/blobs/a.jsonl'),
+                               ('t3', 'data/blobs/b.jsonl')]:
+        empty_db.execute('INSERT INTO tasks (id, name, data_path) VALUES (?, ?, ?)', (task_id, task_id, data_path))
+    empty_db.execute("UPDATE tasks SET data_path = 'data/blobs/b.jsonl' WHERE id = 't2'")
+    empty_db.execute("DELETE FROM tasks WHERE id = 't1'")
+    empty_db.commit()
+
+    recorded = dict(empty_db.execute('SELECT path, ref_count FROM data_blobs'))
+    actual = dict(empty_db.execute('''
+        SELECT data_blobs.path, COUNT(tasks.id) FROM data_blobs
+        LEFT JOIN tasks ON tasks.data_path = data_blobs.path
+        GROUP BY data_blobs.path
+    '''))
+    assert recorded == actual == {'data/blobs/a.jsonl': 0, 'data/blobs/b.jsonl': 2}
@@ -0,0 +1,96 @@
+"""
+markdown_cache 清洗规则的回归用例
+"""
+
+import pytest
+
+pytest.importorskip('markdown')
+pytest.importorskip('bs4')
+
+import markdown_cache
+
+
+@pytest.mark.parametrize('source', [
+    '<a href="java&#9;script:alert(1)">x</a>',
+    '<a href="java&#10;script:alert(1)">x</a>',
+    '<a href="java&#13;script:alert(1)">x</a>',
+    '<a href=" &#1;javascript:alert(1)">x</a>',
+    '<a href="JaVaScRiPt:alert(1)">x</a>',
+    '<a href="&#106;avascript:alert(1)">x</a>',
+    '<a href="java&amp;#9;script:alert(1)">x</a>',
+    '<img src="data:text/html;base64,PHNjcmlwdD4=">',
+    '[x](java&#9;script:alert(1))',
+    '[x](java&#10;script:alert(1))',
+    '[x](vbscript:msgbox(1))',
+])
+def test_unsafe_urls_are_dropped(source):
+    html = markdown_cache.render_html(source)
+    assert html is not None
+    assert 'script:' not in html.lower()
+    assert 'data:' not in html.lower()
+
+
+@pytest.mark.parametrize('url', [
+    'https://example.com/a?b=1',
+    'http://example.com',
+    'mailto:someone@example.com',
+    'images/a.png',
+    '/docs/page#section',
+    '?page=2',
+    '#anchor',
+    'notes/a:b.txt',
+])
+def test_allowed_urls_are_kept(url):
+    html = markdown_cache.render_html(f'[x]({url})')
+    assert 'href=' in html
+
+
+def test_dropped_tags_are_removed():
+    html = markdown_cache.render_html('<script>alert(1)</script><p onclick="x()">ok</p>')
+    assert '<script' not in html
+    assert 'onclick' not in html
+    assert 'ok' in html
+
+
+def test_missing_latex_dependency_is_not_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(markdown_cache, 'MARKDOWN_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(markdown_cache, 'latex_to_mathml', None)
+    text = 'formula $x^2$ missing-dependency-case'
+    assert markdown_cache.get_html(text) is None
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize('source', [
+    r'$\text{<script>alert(1)</script>}$',
+    r'$\text{<img/src/onerror=alert(1)>}$',
+    r'$$\text{<a href="javascript:alert(1)">x</a>}$$',
+    r'$\text{<iframe src="https://example.com"></iframe>}$',
+])
+def test_mathml_output_is_sanitized(source):
+    pytest.importorskip('latex2mathml')
+    html = markdown_cache.render_html(source)
+    assert html is not None
+    assert '<math' in html
+    for fragment in ('<script', 'onerror', 'javascript:', '<iframe'):
+        assert fragment not in html.lower()
+
+
+def test_math_is_converted():
+    pytest.importorskip('latex2mathml')
+    html = markdown_cache.render_html(r'Euler $e^{i\pi}+1=0$ and $$\frac{a}{b}$$')
+    assert '<msup>' in html and '<mfrac>' in html
+    assert 'display="block"' in html
+
+
+def test_literal_placeholder_text_is_left_alone():
+    pytest.importorskip('latex2mathml')
+    html = markdown_cache.render_html('MATHPLACEHOLDER5X MATHPLACEHOLDER0X and $x$')
+    assert 'MATHPLACEHOLDER5X MATHPLACEHOLDER0X' in html
+    assert html.count('<math') == 1
+
+
+def test_placeholder_in_attribute_restores_formula_source():
+    pytest.importorskip('latex2mathml')
+    html = markdown_cache.render_html('[x](http://a/$a$) and $b$')
+    assert 'href="http://a/$a$"' in html
+    assert html.count('<math') == 1